@@ -2,16 +2,28 @@ import streamlit as st
 import pandas as pd
 import os
 import sys
+import io
+import hashlib
 import logging
-from processor import process_payroll_data
+from datetime import date
+from processor import PayrollPipeline, payroll_cache_key, get_payroll_result, get_payroll_cache_stats
+from validation import validate_payroll_input, has_errors
+from ingest import parse_finance_upload, get_ingest_cache_stats, detect_format, INPUT_FORMATS
 from database import (init_db, save_payroll_to_db, fetch_history, add_employee, 
                       update_employee, delete_employee, get_all_employees, 
-                      get_employee_by_id, login_user, add_user, get_all_users, delete_user)
-from pdf_gen import generate_zip_payslips, create_single_pdf
+                      get_employee_by_id, login_user, add_user, get_all_users, delete_user,
+                      reset_connection_stats, get_connection_stats, get_startup_report,
+                      MONTHS, fetch_history_range, last_n_periods, tax_year_periods, get_archived_runs,
+                      get_employee_master_version)
+from employee_import import import_employees, apply_employee_import
+from log_setup import configure_logging, set_log_user, LOG_FILE
+from log_viewer import tail_lines, get_log_index, LEVELS as LOG_LEVELS
+from metrics import get_metrics, reset_metrics, prometheus_text, write_prometheus
+from pdf_gen import get_zip_payslips, get_zip_cache_stats, get_combined_payslips, get_single_pdf, row_fingerprints, ZIP_COMPRESSION_METHODS, ZIP_COMPRESSION
 
 # 1. Initialize Logging & DB
-logging.basicConfig(filename='system.log', level=logging.INFO, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+configure_logging()
+reset_connection_stats()
 init_db()
 
 # 2. Page Configuration
@@ -32,6 +44,7 @@ def login_page():
             if role:
                 st.session_state['logged_in'] = True
                 st.session_state['user_role'] = role
+                st.session_state['username'] = user
                 st.rerun()
             else:
                 st.error("Invalid Username or Password")
@@ -39,6 +52,7 @@ def login_page():
 if not st.session_state['logged_in']:
     login_page()
     st.stop()
+set_log_user(st.session_state.get('username'))
 
 # ==========================================
 # SIDEBAR SETUP
@@ -65,20 +79,22 @@ if st.sidebar.button("Logout"):
 
 st.sidebar.markdown("---")
 st.sidebar.header("⚙️ Global Settings")
-sel_month = st.sidebar.selectbox("Processing Month", 
-    ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"])
+sel_month = st.sidebar.selectbox("Processing Month", MONTHS)
 sel_year = st.sidebar.number_input("Processing Year", value=2026, step=1)
 
 st.sidebar.subheader("Calculation Constants")
 working_days = st.sidebar.number_input("Working Days", value=30)
 stamps_fee = st.sidebar.number_input("Stamps Fee (LKR)", value=25.0)
+exact_cents = st.sidebar.checkbox("Exact cent arithmetic", value=False,
+                                  help="Calculate on whole cents with fixed rounding rules (half-up for No-pay, Tax, EPF and ETF).")
 
 st.sidebar.subheader("Statutory Rates (%)")
 epf_emp = st.sidebar.slider("EPF Employee Contribution (%)", 0, 15, 8) / 100
 epf_co = st.sidebar.slider("EPF Employer Contribution (%)", 0, 20, 12) / 100
 etf_co = st.sidebar.slider("ETF Employer Contribution (%)", 0, 10, 3) / 100
 
-config = {'working_days': working_days, 'stamps_fee': stamps_fee, 'epf_emp_rate': epf_emp, 'epf_co_rate': epf_co, 'etf_co_rate': etf_co}
+config = {'working_days': working_days, 'stamps_fee': stamps_fee, 'epf_emp_rate': epf_emp, 'epf_co_rate': epf_co, 'etf_co_rate': etf_co,
+          'money_mode': 'cents' if exact_cents else 'float'}
 
 # --- NAVIGATION TABS ---
 tabs_list = ["🚀 Payroll Processing", "👥 Employee Management", "📜 History"]
@@ -90,20 +106,50 @@ selected_tabs = st.tabs(tabs_list)
 # TAB 1: PAYROLL PROCESSING
 with selected_tabs[0]:
     st.subheader(f"Step 1: Upload Data for {sel_month} {sel_year}")
-    uploaded_file = st.file_uploader("Upload Finance Excel Sheet", type=['xlsx'])
+    uploaded_file = st.file_uploader("Upload Finance Sheet (Excel, CSV or Parquet)", type=list(INPUT_FORMATS))
     if uploaded_file:
-        df_input = pd.read_excel(uploaded_file)
+        upload_digest, df_input = parse_finance_upload(uploaded_file.getvalue(), detect_format(uploaded_file.name))
         st.write("### 📄 Data Preview (First 5 Rows)")
         st.dataframe(df_input.head())
-        if st.button("Calculate Payroll for All Employees"):
+
+        # Bulk checks before anything is calculated; errors block the calculation
+        validation_report = validate_payroll_input(df_input, get_all_employees(), config)
+        input_ok = not has_errors(validation_report)
+        if not validation_report.empty:
+            n_errors = int((validation_report['severity'] == 'error').sum())
+            n_warnings = len(validation_report) - n_errors
+            if n_errors:
+                st.error(f"{n_errors} problem(s) must be fixed in the sheet before calculating ({n_warnings} warning(s)).")
+            else:
+                st.warning(f"{n_warnings} warning(s) found in the uploaded sheet.")
+            with st.expander("🔎 Validation Report", expanded=bool(n_errors)):
+                st.dataframe(validation_report, use_container_width=True, hide_index=True)
+        # One staged pipeline per session: a sidebar change only recomputes the affected columns,
+        # and any (upload, settings, employee master) combination seen before is served from cache
+        pipeline = st.session_state.setdefault('pipeline', PayrollPipeline())
+        calc_key = payroll_cache_key(upload_digest, config)
+        prev_key = st.session_state.get('calc_key')
+        if st.button("Calculate Payroll for All Employees", disabled=not input_ok):
             try:
-                df_result = process_payroll_data(df_input, config)
-                st.session_state['result'] = df_result
+                st.session_state['result'] = get_payroll_result(pipeline, df_input, config, upload_digest)
+                st.session_state['calc_key'] = calc_key
                 st.success("Calculations complete!")
             except Exception as e:
                 st.error(f"Error in calculation: {e}")
+        elif input_ok and 'result' in st.session_state and prev_key and prev_key[0] == upload_digest and prev_key != calc_key:
+            try:
+                st.session_state['result'] = get_payroll_result(pipeline, df_input, config, upload_digest)
+                st.session_state['calc_key'] = calc_key
+                st.info("Settings or employee records changed - results updated.")
+            except Exception as e:
+                st.error(f"Error in calculation: {e}")
 
-        if 'result' in st.session_state:
+        # Only a result calculated from exactly this upload, these settings and this
+        # employee master may be shown, downloaded or archived
+        result_current = input_ok and st.session_state.get('calc_key') == calc_key
+        if 'result' in st.session_state and not result_current:
+            st.info("The last results no longer match the uploaded sheet, settings or employee records - calculate again.")
+        if 'result' in st.session_state and result_current:
             df_final = st.session_state['result']
             st.markdown("---")
             st.subheader("📊 Payroll Summary Metrics")
@@ -116,21 +162,67 @@ with selected_tabs[0]:
             st.dataframe(df_final)
 
             col_zip, col_db = st.columns(2)
-            with st.spinner("Preparing ZIP..."):
-                zip_data = generate_zip_payslips(df_final, sel_month, sel_year)
+            zip_methods = list(ZIP_COMPRESSION_METHODS)
+            zip_compression = col_zip.selectbox("ZIP Compression", zip_methods, index=zip_methods.index(ZIP_COMPRESSION),
+                                                help="deflate: smaller download for little extra time; lzma: smallest, slowest")
+            # Built (or fetched from the ZIP cache) and read into memory only on the rerun after
+            # this click; unlike the combined PDF it is not kept ready, so other reruns copy nothing
+            if col_zip.button("📦 Prepare Payslip ZIP"):
+                with st.spinner("Preparing ZIP..."):
+                    zip_data = get_zip_payslips(df_final, sel_month, sel_year, compression=zip_compression)
                 col_zip.download_button(label="📦 Download All Payslips (ZIP)", data=zip_data, file_name=f"Payslips_{sel_month}_{sel_year}.zip", mime="application/zip")
+            archive_mode = 'replace'
+            archived_runs = get_archived_runs(sel_month, sel_year)
+            if archived_runs:
+                col_db.warning(f"{sel_month} {sel_year} is already archived ({len(archived_runs)} run(s)).")
+                archive_mode = col_db.radio("On save", ['replace', 'version'], horizontal=True, key='archive_mode',
+                                            format_func=lambda m: "Replace existing month" if m == 'replace' else "Keep as new version")
             if col_db.button("💾 Save to History Database"):
-                save_payroll_to_db(df_final, sel_month, sel_year)
-                st.success("Archived successfully!")
+                try:
+                    saved = save_payroll_to_db(df_final, sel_month, sel_year, mode=archive_mode)
+                    st.success(f"Archived successfully! (run {saved['run_no']}, {saved['rows']} records)")
+                except Exception as e:
+                    st.error(f"Archive failed, nothing was saved: {e}")
+
+            # Print-ready single PDF, only rendered when asked for; kept ready only for the
+            # result it was prepared from (calc_key), so a recalculation needs a new click
+            col_print, col_group = st.columns(2)
+            print_group = col_group.selectbox("Combined PDF page order", ["By Employee ID", "Grouped by Department"], key='print_group')
+            print_key = ('combined', st.session_state.get('calc_key'), sel_month, sel_year, print_group)
+            if st.session_state.get('combined_ready') == print_key or col_print.button("🖨️ Prepare Combined PDF for Printing"):
+                st.session_state['combined_ready'] = print_key
+                with st.spinner("Rendering combined PDF..."):
+                    combined_pdf = get_combined_payslips(df_final, sel_month, sel_year,
+                                                         group_by='department' if print_group == "Grouped by Department" else None)
+                col_print.download_button("📄 Download Combined PDF", data=combined_pdf, file_name=f"Payslips_{sel_month}_{sel_year}_print.pdf", mime="application/pdf")
 
             st.markdown("---")
             st.subheader("👤 Individual Employee Quick-View & PDF")
-            for i, row in df_final.iterrows():
+            qv_col1, qv_col2 = st.columns([3, 1])
+            qv_search = qv_col1.text_input("Search by Employee ID or Name", key='qv_search').strip()
+            df_view = df_final
+            if qv_search:
+                qv_mask = (df_final['Employee ID'].astype(str).str.contains(qv_search, case=False, regex=False) |
+                           df_final['Name'].astype(str).str.contains(qv_search, case=False, regex=False))
+                df_view = df_final[qv_mask]
+            qv_page_size = 20
+            qv_pages = max(1, -(-len(df_view) // qv_page_size))
+            qv_page = qv_col2.selectbox(f"Page (of {qv_pages})", range(1, qv_pages + 1), key='qv_page')
+            df_page = df_view.iloc[(qv_page - 1) * qv_page_size : qv_page * qv_page_size]
+            st.caption(f"Showing {len(df_page)} of {len(df_view)} employees")
+
+            # PDFs are only rendered once a user asks for them
+            qv_ready = st.session_state.setdefault('qv_ready', set())
+            qv_fingerprints = row_fingerprints(df_page)
+            for i, row in df_page.iterrows():
                 with st.expander(f"{row['Employee ID']} - {row['Name']}"):
                     c_left, c_right = st.columns([3, 1])
                     c_left.write(f"**Gross:** {row['Gross Salary']:,.2f} | **Deductions:** {row['Total Deduction']:,.2f} | **Net:** {row['Net Salary']:,.2f}")
-                    pdf_bytes = create_single_pdf(row, sel_month, sel_year)
-                    c_right.download_button("Download PDF", data=pdf_bytes, file_name=f"{row['Employee ID']}_{row['Name']}.pdf", mime="application/pdf", key=f"btn_{row['Employee ID']}_{i}")
+                    fp = qv_fingerprints[i]
+                    if fp in qv_ready or c_right.button("Prepare PDF", key=f"prep_{row['Employee ID']}_{i}"):
+                        qv_ready.add(fp)
+                        pdf_bytes = get_single_pdf(row, sel_month, sel_year, fp)
+                        c_right.download_button("Download PDF", data=pdf_bytes, file_name=f"{row['Employee ID']}_{row['Name']}.pdf", mime="application/pdf", key=f"btn_{row['Employee ID']}_{i}")
 
 # TAB 2: EMPLOYEE MANAGEMENT
 with selected_tabs[1]:
@@ -165,14 +257,52 @@ with selected_tabs[1]:
                     if cb1.form_submit_button("Update"): update_employee(c_id, e_name, e_desig, e_dept, e_nic, e_bank, e_acc, e_date); st.rerun()
                     if cb2.form_submit_button("Delete", type="primary"): delete_employee(c_id); st.rerun()
 
+    with st.expander("📥 Bulk Import from Spreadsheet"):
+        st.caption("Columns: Employee ID, Name, Designation, Department, NIC, Bank, Account No, Joined Date. "
+                   "New IDs are added and existing IDs updated; blank cells keep the stored value.")
+        emp_file = st.file_uploader("Employee Sheet (Excel or CSV)", type=['xlsx', 'csv'], key='emp_import_file')
+        if emp_file:
+            # Dry run once per (file, master version); Apply writes exactly the plan shown
+            import_key = (hashlib.sha256(emp_file.getvalue()).hexdigest(), get_employee_master_version())
+            if st.session_state.get('emp_import_key') != import_key:
+                st.session_state['emp_import'] = import_employees(io.BytesIO(emp_file.getvalue()), 
+                                                                  detect_format(emp_file.name), dry_run=True)
+                st.session_state['emp_import_key'] = import_key
+            emp_import = st.session_state['emp_import']
+            if not emp_import['report'].empty:
+                st.dataframe(emp_import['report'], use_container_width=True, hide_index=True)
+            plan = emp_import['plan']
+            if plan is None:
+                st.error("Fix the errors above before importing.")
+            else:
+                i1, i2, i3 = st.columns(3)
+                i1.metric("New", len(plan['insert'])); i2.metric("Changed", len(plan['update'])); i3.metric("Unchanged", plan['unchanged'])
+                st.caption(f"Dry run: {emp_import['rows']} rows checked in {sum(emp_import['seconds'].values()):.2f}s "
+                           f"({emp_import['rows_per_second']:,.0f} rows/s).")
+                if not plan['changes'].empty:
+                    st.dataframe(plan['changes'], use_container_width=True, hide_index=True)
+                if st.button("Apply Import", disabled=plan['insert'].empty and plan['update'].empty):
+                    try:
+                        applied = apply_employee_import(plan)
+                        st.success(f"Imported: {applied['inserted']} added, {applied['updated']} updated.")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Import failed, nothing was saved: {e}")
+
 # TAB 3: HISTORY
 with selected_tabs[2]:
     st.header("Search Past Records")
+    h_mode = st.radio("Range", ["Single Month", "Last 12 Months", "Tax Year (Apr - Mar)"], horizontal=True, key='hist_mode')
     h_col1, h_col2 = st.columns(2)
-    h_m = h_col1.selectbox("Month", ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"], key='hist_m')
-    h_y = h_col2.number_input("Year", value=2026, key='hist_y')
+    h_m = h_col1.selectbox("Month", MONTHS, key='hist_m', disabled=h_mode == "Tax Year (Apr - Mar)")
+    h_y = h_col2.number_input("Year" if h_mode != "Tax Year (Apr - Mar)" else "Tax Year Starting", value=2026, key='hist_y')
     if st.button("Retrieve Records"):
-        hist_df = fetch_history(h_m, h_y)
+        if h_mode == "Single Month":
+            hist_df = fetch_history(h_m, h_y)
+        elif h_mode == "Last 12 Months":
+            hist_df = fetch_history_range(*last_n_periods(12, h_m, h_y))
+        else:
+            hist_df = fetch_history_range(*tax_year_periods(h_y))
         if not hist_df.empty: st.dataframe(hist_df); st.metric("Total Payout", f"LKR {hist_df['net_salary'].sum():,.2f}")
         else: st.warning("No records found.")
 
@@ -199,11 +329,59 @@ if st.session_state['user_role'] == 'Admin':
         # --- SYSTEM LOG VIEWER ---
         st.divider()
         st.subheader("🛡️ System Integrity Logs")
-        if os.path.exists("system.log"):
-            with open("system.log", "r") as log_file:
-                log_content = log_file.read()
-            st.download_button("📥 Download Full Log File", log_content, "system.log", "text/plain")
+        if os.path.exists(LOG_FILE):
+            # download_button reads whatever it is given into memory, so the full log is
+            # only read on the rerun after this click, not on every admin page view
+            if st.button("📥 Prepare Full Log Download"):
+                with open(LOG_FILE, "rb") as log_handle:
+                    st.download_button("📥 Download Full Log File", log_handle.read(), "system.log", "text/plain")
             with st.expander("View Recent Log Activity"):
-                st.text_area("Log Output", log_content[-2000:], height=300)
+                st.text_area("Log Output", "\n".join(tail_lines(LOG_FILE, 30)), height=300)
+            with st.expander("🔍 Search Logs"):
+                log_index = get_log_index(LOG_FILE)
+                f_col1, f_col2, f_col3 = st.columns(3)
+                f_levels = f_col1.multiselect("Level", LOG_LEVELS, default=['WARNING', 'ERROR', 'CRITICAL'])
+                f_user = f_col2.selectbox("User", ["All"] + log_index.users)
+                f_dates = f_col3.date_input("Dates", value=(log_index.first_day() or date.today(), date.today()))
+                # a range picker returns one date while the second is still being chosen
+                f_dates = tuple(f_dates) if isinstance(f_dates, (tuple, list)) else (f_dates,)
+                f_start, f_end = (f_dates[0] if f_dates else None), (f_dates[1] if len(f_dates) > 1 else None)
+                log_page_size = 100
+                log_page_no = st.number_input("Page", min_value=1, value=1, step=1, key='log_page') - 1
+                entries, n_matches = log_index.page(log_page_no, log_page_size, levels=f_levels,
+                                                    user=None if f_user == "All" else f_user, start=f_start, end=f_end)
+                st.caption(f"{n_matches} matching lines (newest first), page {log_page_no + 1} of {max(1, -(-n_matches // log_page_size))}")
+                if entries:
+                    st.dataframe(pd.DataFrame(entries).reindex(columns=['ts', 'level', 'user', 'msg', 'exc']).dropna(axis=1, how='all'),
+                                 use_container_width=True, hide_index=True)
         else:
-            st.info("No logs generated yet.")
\ No newline at end of file
+            st.info("No logs generated yet.")
+
+        # --- DB CONNECTION USAGE (this rerun) ---
+        conn_stats = get_connection_stats()
+        st.caption(f"DB connections opened this run: {conn_stats['opened']} | connection checkouts: {conn_stats['checkouts']}")
+        cache_stats = {'Parsed uploads': get_ingest_cache_stats(), 'Payroll results': get_payroll_cache_stats(), 
+                       'Payslip ZIPs': get_zip_cache_stats()}
+        with st.expander("Cache Statistics"):
+            st.dataframe(pd.DataFrame(cache_stats).T, use_container_width=True)
+
+        # --- PERFORMANCE (since start-up or the last reset) ---
+        with st.expander("⏱️ Performance"):
+            perf = pd.DataFrame(get_metrics()).T
+            if perf.empty:
+                st.info("No timings recorded yet.")
+            else:
+                perf['avg_ms'] = perf['seconds'] / perf['calls'] * 1000
+                perf['rows_per_s'] = (perf['rows'] / perf['seconds']).where(perf['rows'] > 0)
+                st.dataframe(perf[['calls', 'seconds', 'avg_ms', 'max_seconds', 'rows', 'rows_per_s', 'rss_growth_bytes']]
+                             .astype(float).round(4), use_container_width=True)
+            p_col1, p_col2, p_col3 = st.columns(3)
+            p_col1.download_button("📥 Prometheus Metrics", prometheus_text(), "metrics.prom", "text/plain")
+            if p_col2.button("Write metrics.prom"):
+                st.success(f"Written to {write_prometheus()}")
+            if p_col3.button("Reset Timings"):
+                reset_metrics(); st.rerun()
+        startup = get_startup_report()
+        if startup:
+            st.caption(f"Schema v{startup['to_version']} | startup migration took {startup['elapsed_ms']:.1f} ms "
+                       f"({len(startup['applied'])} step(s) applied)")
\ No newline at end of file
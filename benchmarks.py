@@ -0,0 +1,251 @@
+"""Scaling benchmarks on deterministic synthetic payroll data.
+
+    python benchmarks.py --sizes 100,1000,10000,100000 --output bench.json
+    python benchmarks.py --compare bench.json          # re-run and flag regressions
+
+Every scenario runs against a throw-away database in a temporary directory, so
+the real property_payroll.db is never touched. Results are JSON: one entry per
+(scenario, employees) with the best time over --repeat runs; 'rows' is how many
+rows the timed call handled (create_single_pdf renders a fixed sample).
+
+Finance-sheet parsing is timed per input format: excel_parse, csv_parse and
+parquet_parse. The payslip ZIP is built with every compression method:
+generate_zip_payslips is the default method, zip_<method> the others.
+generate_combined_payslips runs at the same sizes, for comparison with the ZIP.
+
+evaluate_formulas, in float and exact-cents money mode, runs separately at
+--formula-sizes, since it needs neither the database nor a sheet.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import database
+from database import EMPLOYEE_COLUMNS, init_db, upsert_employees, save_payroll_to_db, fetch_history
+from ingest import read_finance_workbook
+from processor import process_payroll_data, evaluate_formulas, NUMERIC_COLS
+from pdf_gen import (create_single_pdf, generate_zip_payslips, generate_combined_payslips,
+                     ZIP_COMPRESSION_METHODS, ZIP_COMPRESSION)
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+DEFAULT_FORMULA_SIZES = [10000, 100000, 1000000]
+PDF_SAMPLE = 200           # create_single_pdf cost doesn't depend on the batch size
+MAX_ZIP_ROWS = 1000        # generate_zip_payslips runs ~150 payslips/s per core
+MAX_EXCEL_ROWS = 100000
+REGRESSION_THRESHOLD = 1.2
+
+# --- SYNTHETIC DATA ---
+def synthetic_employees(n, seed=0):
+    """n rows for the employees table, IDs E0000000.. in order."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'emp_id': [f"E{i:07d}" for i in range(n)],
+        'name': [f"Employee {i}" for i in range(n)],
+        'designation': rng.choice(['Officer', 'Senior Officer', 'Manager', 'Driver', 'Clerk'], n),
+        'department': rng.choice(['Operations', 'Finance', 'HR', 'Maintenance'], n),
+        'nic': [f"{199000000000 + i}" for i in range(n)],
+        'bank_name': rng.choice(['BOC', 'HNB', 'Sampath', 'Commercial'], n),
+        'account_no': rng.integers(10**9, 10**10, n).astype(str),
+        'joined_date': (pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 3650, n), unit='D')).strftime('%Y-%m-%d'),
+    })[EMPLOYEE_COLUMNS]
+
+def synthetic_finance(n, seed=0):
+    """A finance sheet for synthetic_employees(n): 'Employee ID' plus every NUMERIC_COLS column."""
+    rng = np.random.default_rng(seed + 1)
+    df = pd.DataFrame({
+        'Employee ID': [f"E{i:07d}" for i in range(n)],
+        'Basic salary': rng.uniform(40000, 350000, n).round(2),
+        'Reimburse allowances': rng.choice([0.0, 2500.0, 5000.0], n),
+        'Travelling allowances': rng.uniform(0, 15000, n).round(2),
+        'Nopay days': rng.choice([0, 0, 0, 1, 2, 3], n).astype(float),
+        'Salary adjustment': rng.choice([0.0, 0.0, -1500.0, 2000.0], n),
+        'Tax rate': rng.choice([0.0, 0.06, 0.12, 0.18, 0.24], n),
+        'APIT': rng.choice([0.0, 250.0, 1000.0], n),
+        'Salary advances': rng.choice([0.0, 5000.0, 10000.0], n),
+        'Loan installment': rng.choice([0.0, 0.0, 3500.0], n),
+        'Loan interest': rng.choice([0.0, 0.0, 450.0], n),
+        'Others': rng.choice([0.0, 100.0], n),
+        'Stamps fee': rng.choice([0.0, 0.0, 50.0], n),
+    })
+    return df[['Employee ID'] + NUMERIC_COLS]
+
+# --- SCENARIOS ---
+def _best_of(fn, repeat):
+    """(best seconds, last result) over repeat calls."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+def _entry(scenario, employees, rows, seconds, **extra):
+    return {'scenario': scenario, 'employees': employees, 'rows': rows, 'seconds': round(seconds, 6),
+            'rows_per_second': round(rows / seconds, 1) if seconds else None, **extra}
+
+def run_size(n, repeat=3, max_zip_rows=MAX_ZIP_ROWS, max_excel_rows=MAX_EXCEL_ROWS, month='March', year=2026):
+    """Every scenario at n employees; the database must already point at a scratch file."""
+    results = []
+    employees = synthetic_employees(n)
+    upsert_employees(employees.itertuples(index=False, name=None), [])
+    df_input = synthetic_finance(n)
+
+    for scenario, fmt in [('excel_parse', 'xlsx'), ('csv_parse', 'csv'), ('parquet_parse', 'parquet')]:
+        if fmt == 'xlsx' and n > max_excel_rows:
+            results.append({'scenario': scenario, 'employees': n, 'rows': n, 'skipped': f"above --max-excel-rows {max_excel_rows}"})
+            continue
+        try:
+            data = _sheet_bytes(df_input, fmt)
+        except ImportError as e:   # parquet needs pyarrow
+            results.append({'scenario': scenario, 'employees': n, 'rows': n, 'skipped': str(e)})
+            continue
+        seconds, _ = _best_of(lambda: read_finance_workbook(io.BytesIO(data), fmt), repeat)
+        results.append(_entry(scenario, n, n, seconds, bytes=len(data)))
+
+    seconds, df_final = _best_of(lambda: process_payroll_data(df_input, {}), repeat)
+    results.append(_entry('merge_calculate', n, n, seconds))
+
+    sample = df_final.head(PDF_SAMPLE).to_dict('records')
+    seconds, _ = _best_of(lambda: [create_single_pdf(row, month, year) for row in sample], repeat)
+    results.append(_entry('create_single_pdf', n, len(sample), seconds, per_pdf_ms=round(seconds / len(sample) * 1000, 3)))
+
+    if n <= max_zip_rows:
+        zip_seconds = None
+        for method in ZIP_COMPRESSION_METHODS:
+            def build_zip():
+                with generate_zip_payslips(df_final, month, year, compression=method) as zip_file:
+                    return zip_file.seek(0, os.SEEK_END)
+            seconds, zip_bytes = _best_of(build_zip, 1)
+            scenario = 'generate_zip_payslips' if method == ZIP_COMPRESSION else f"zip_{method}"
+            results.append(_entry(scenario, n, n, seconds, bytes=zip_bytes, compression=method))
+            if method == ZIP_COMPRESSION:
+                zip_seconds = seconds
+        seconds, pdf = _best_of(lambda: generate_combined_payslips(df_final, month, year), 1)
+        results.append(_entry('generate_combined_payslips', n, n, seconds, bytes=len(pdf),
+                              vs_zip=round(seconds / zip_seconds, 3) if zip_seconds else None))
+    else:
+        for scenario in ['generate_zip_payslips'] + [f"zip_{m}" for m in ZIP_COMPRESSION_METHODS if m != ZIP_COMPRESSION] + ['generate_combined_payslips']:
+            results.append({'scenario': scenario, 'employees': n, 'rows': n, 'skipped': f"above --max-zip-rows {max_zip_rows}"})
+
+    seconds, _ = _best_of(lambda: save_payroll_to_db(df_final, month, year, mode='replace'), repeat)
+    results.append(_entry('save_payroll_to_db', n, n, seconds))
+
+    seconds, history = _best_of(lambda: fetch_history(month, year), repeat)
+    results.append(_entry('fetch_history', n, len(history), seconds))
+    return results
+
+def _sheet_bytes(df, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'xlsx':
+        df.to_excel(buffer, index=False)
+    elif fmt == 'csv':
+        df.to_csv(buffer, index=False)
+    else:
+        df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+def run_formulas(n, repeat=3):
+    """evaluate_formulas over n rows, float vs exact-cents money mode."""
+    df_input = synthetic_finance(n)
+    values = {col: df_input[col].to_numpy(dtype='float64') for col in NUMERIC_COLS}
+    float_seconds, _ = _best_of(lambda: evaluate_formulas(values, {'money_mode': 'float'}), repeat)
+    cents_seconds, _ = _best_of(lambda: evaluate_formulas(values, {'money_mode': 'cents'}), repeat)
+    return [_entry('evaluate_formulas', n, n, float_seconds, money_mode='float'),
+            _entry('evaluate_formulas_cents', n, n, cents_seconds, money_mode='cents',
+                   vs_float=round(cents_seconds / float_seconds, 3))]
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_benchmarks(sizes=DEFAULT_SIZES, repeat=3, max_zip_rows=MAX_ZIP_ROWS, max_excel_rows=MAX_EXCEL_ROWS, log=print,
+                   formula_sizes=DEFAULT_FORMULA_SIZES):
+    """Run every size against a fresh scratch database, then the formula sizes; returns the JSON-ready report."""
+    report = {
+        'meta': {'timestamp': datetime.now().isoformat(timespec='seconds'), 'commit': _git_commit(),
+                 'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                 'pandas': pd.__version__, 'numpy': np.__version__, 'repeat': repeat},
+        'results': [],
+    }
+    saved_db = database.DB_NAME
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            for n in sizes:
+                database.DB_NAME = os.path.join(tmp, f"bench_{n}.db")
+                init_db()
+                for entry in run_size(n, repeat, max_zip_rows, max_excel_rows):
+                    report['results'].append(entry)
+                    if log:
+                        log(_format_entry(entry))
+                database.close_connections()
+        finally:
+            database.DB_NAME = saved_db
+    for n in formula_sizes:
+        for entry in run_formulas(n, repeat):
+            report['results'].append(entry)
+            if log:
+                log(_format_entry(entry))
+    return report
+
+def _format_entry(entry):
+    if 'skipped' in entry:
+        return f"{entry['scenario']:<28}{entry['employees']:>8}  skipped ({entry['skipped']})"
+    return f"{entry['scenario']:<28}{entry['employees']:>8}  {entry['seconds']:>9.4f}s  {entry['rows_per_second'] or 0:>12,.0f} rows/s"
+
+def compare_reports(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """[(scenario, employees, baseline s, current s, ratio)] for entries present in both; ratio > threshold is a regression."""
+    old = {(e['scenario'], e['employees']): e['seconds'] for e in baseline['results'] if 'seconds' in e}
+    rows = []
+    for e in current['results']:
+        key = (e['scenario'], e['employees'])
+        if 'seconds' in e and old.get(key):
+            rows.append((*key, old[key], e['seconds'], e['seconds'] / old[key]))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the payroll pipeline on synthetic data.")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help="comma-separated employee counts")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per scenario; the best time is kept")
+    parser.add_argument('--formula-sizes', default=','.join(map(str, DEFAULT_FORMULA_SIZES)),
+                        help="comma-separated row counts for evaluate_formulas (empty to skip)")
+    parser.add_argument('--max-zip-rows', type=int, default=MAX_ZIP_ROWS)
+    parser.add_argument('--max-excel-rows', type=int, default=MAX_EXCEL_ROWS)
+    parser.add_argument('--output', help="write the JSON report here (default: stdout)")
+    parser.add_argument('--compare', help="baseline JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help="slowdown ratio counted as a regression")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    formula_sizes = [int(s) for s in args.formula_sizes.split(',') if s.strip()]
+    report = run_benchmarks(sizes, args.repeat, args.max_zip_rows, args.max_excel_rows,
+                            log=lambda line: print(line, file=sys.stderr), formula_sizes=formula_sizes)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    elif not args.compare:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = 0
+        for scenario, employees, before, after, ratio in compare_reports(baseline, report, args.threshold):
+            flag = "  REGRESSION" if ratio > args.threshold else ""
+            regressions += bool(flag)
+            print(f"{scenario:<28}{employees:>8}  {before:>9.4f}s -> {after:>9.4f}s  x{ratio:.2f}{flag}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,16 @@
 import sqlite3
 import pandas as pd
 from datetime import datetime
+import contextvars
 import hashlib
 import logging
 import os
 import sys
+import threading
+import time
+from contextlib import contextmanager
+from metrics import timed, span
+from log_setup import configure_logging
 
 # --- DYNAMIC PATH RESOLUTION ---
 # This ensures the database and logs stay in the folder where the .exe is located
@@ -15,168 +21,457 @@ else:
     # Running as a normal python script
     base_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Define absolute paths for the database and log file
+# Define absolute paths for the database (the log file lives in log_setup.LOG_FILE)
 DB_NAME = os.path.join(base_dir, "property_payroll.db")
-LOG_FILE = os.path.join(base_dir, "system.log")
 
-# Configure Logging to use the absolute path
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+# Queue-based JSON logging to the shared, rotated system.log
+configure_logging()
+
+# --- CONNECTION MANAGEMENT ---
+# Streamlit re-executes the whole script on every widget interaction, in a new
+# thread each time, so neither a connect() per call nor a connection per thread
+# lasts. Instead a small process-wide pool keeps a few idle connections per
+# database file and every data-access function borrows one through
+# get_connection(). The pool is keyed by pid as well: a forked worker must never
+# touch the parent's SQLite handles, so it starts with an empty pool of its own.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # readers no longer block the writer
+    "PRAGMA synchronous=NORMAL",    # safe with WAL, far fewer fsyncs
+    "PRAGMA busy_timeout=5000",     # wait up to 5s on a locked database
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",      # ~8 MB page cache per connection
+)
+POOL_SIZE = 4   # idle connections kept per database file
+
+_pool = {}   # (pid, db path) -> idle connections
+_pool_lock = threading.Lock()
+
+# Counters for the current session's rerun (reset_connection_stats() starts a
+# new set in the calling context); calls outside any such context aren't counted.
+_conn_stats = contextvars.ContextVar('conn_stats', default=None)
+
+def _count(key):
+    stats = _conn_stats.get()
+    if stats is not None:
+        stats[key] += 1
+
+def _open_connection(path):
+    # borrowed by one thread at a time, but not always by the thread that opened it
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    _count('opened')
+    return conn
+
+def _after_fork_in_child():
+    # Another thread may have held the lock at fork time. The parent's
+    # connections stay referenced (under the parent's pid) but are never used:
+    # closing or garbage-collecting them here would release the parent's locks.
+    global _pool_lock
+    _pool_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+@contextmanager
+def get_connection():
+    """Borrow a pooled connection; commits on success, rolls back on error."""
+    key = (os.getpid(), DB_NAME)
+    with _pool_lock:
+        idle = _pool.get(key)
+        conn = idle.pop() if idle else None
+    if conn is None:
+        conn = _open_connection(DB_NAME)
+    _count('checkouts')
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        with _pool_lock:
+            idle = _pool.setdefault(key, [])
+            if len(idle) < POOL_SIZE:
+                idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+def close_connections():
+    """Close this process's idle connections to the current database."""
+    with _pool_lock:
+        idle = _pool.pop((os.getpid(), DB_NAME), [])
+    for conn in idle:
+        conn.close()
+
+def reset_connection_stats():
+    """Start counting connections for the calling context (app.py: once per rerun)."""
+    _conn_stats.set({'opened': 0, 'checkouts': 0})
+
+def get_connection_stats():
+    """Connections opened / borrowed in this context since reset_connection_stats()."""
+    return dict(_conn_stats.get() or {'opened': 0, 'checkouts': 0})
+
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", 
+          "August", "September", "October", "November", "December"]
+
+def period_key(month, year):
+    """'March', 2026 -> 202603 (the payroll_history.period column)."""
+    return int(year) * 100 + MONTHS.index(month) + 1
+
+def shift_period(period, months):
+    """Move a YYYYMM period forward (or back, if negative) by whole months."""
+    index = (period // 100) * 12 + (period % 100 - 1) + months
+    return (index // 12) * 100 + index % 12 + 1
+
+def last_n_periods(n, month, year):
+    """(start, end) periods covering the n months ending with month/year."""
+    end = period_key(month, year)
+    return shift_period(end, -(n - 1)), end
+
+def tax_year_periods(start_year):
+    """(start, end) periods of the April-March year of assessment starting in start_year."""
+    return int(start_year) * 100 + 4, (int(start_year) + 1) * 100 + 3
 
 def hash_password(password):
     return hashlib.sha256(str.encode(password)).hexdigest()
 
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
-    # 1. Base Payroll History Table
+# --- SCHEMA MIGRATIONS ---
+# Ordered steps; applying MIGRATIONS[n - 1] brings the database to PRAGMA
+# user_version n. Steps must tolerate databases created by the old
+# init_db(), which ran everything unconditionally and left user_version at 0.
+def _table_columns(c, table):
+    return {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+
+def _migrate_base_tables(c):
     c.execute('''CREATE TABLE IF NOT EXISTS payroll_history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT, 
                 emp_id TEXT, emp_name TEXT, month TEXT, year INTEGER, 
                 basic_salary REAL, gross_salary REAL, total_deduction REAL, 
                 net_salary REAL, processed_date TIMESTAMP)''')
-
-    # Migration Loop (Fixes "no column named..." errors)
-    needed_columns = [
-        "nopay_amount REAL", "total_tax REAL", 
-        "epf_employee REAL", "epf_company REAL", "etf_company REAL"
-    ]
-    for col_def in needed_columns:
-        try:
-            c.execute(f"ALTER TABLE payroll_history ADD COLUMN {col_def}")
-        except sqlite3.OperationalError:
-            pass
-
-    # 2. Employee Master Table
     c.execute('''CREATE TABLE IF NOT EXISTS employees (
                 emp_id TEXT PRIMARY KEY, name TEXT, designation TEXT, 
                 department TEXT, nic TEXT, bank_name TEXT, 
                 account_no TEXT, joined_date TEXT)''')
-
-    # 3. User Table
     c.execute('CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT, role TEXT)')
-    
-    # Default Admin
-    c.execute("SELECT * FROM users WHERE username='admin'")
+
+def _migrate_history_breakdown_columns(c):
+    existing = _table_columns(c, 'payroll_history')
+    for col, col_type in [("nopay_amount", "REAL"), ("total_tax", "REAL"), 
+                          ("epf_employee", "REAL"), ("epf_company", "REAL"), ("etf_company", "REAL")]:
+        if col not in existing:
+            c.execute(f"ALTER TABLE payroll_history ADD COLUMN {col} {col_type}")
+
+def _migrate_default_admin(c):
+    c.execute("SELECT 1 FROM users WHERE username='admin'")
     if not c.fetchone():
-        admin_pw = hash_password("admin123")
-        c.execute("INSERT INTO users VALUES ('admin', ?, 'Admin')", (admin_pw,))
+        c.execute("INSERT INTO users VALUES ('admin', ?, 'Admin')", (hash_password("admin123"),))
         logging.info("System Initialized: Default Admin account created.")
-        
-    conn.commit()
-    conn.close()
+
+def _migrate_history_period(c):
+    # period = YYYYMM lets month/range lookups use an index instead of
+    # scanning on the TEXT month name.
+    if 'period' not in _table_columns(c, 'payroll_history'):
+        c.execute("ALTER TABLE payroll_history ADD COLUMN period INTEGER")
+    month_case = " ".join(f"WHEN '{m}' THEN {i}" for i, m in enumerate(MONTHS, start=1))
+    c.execute(f"UPDATE payroll_history SET period = year * 100 + CASE month {month_case} END "
+              "WHERE period IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_history_period_emp ON payroll_history (period, emp_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_history_emp_period ON payroll_history (emp_id, period)")
+
+def _migrate_history_runs(c):
+    # Each archive of a month is a numbered run; (emp_id, period, run_no) is
+    # unique, so repeated saves can no longer duplicate rows silently. Earlier
+    # duplicates become successive runs in processed_date order.
+    if 'run_no' not in _table_columns(c, 'payroll_history'):
+        c.execute("ALTER TABLE payroll_history ADD COLUMN run_no INTEGER")
+    c.execute('''UPDATE payroll_history SET run_no = (
+                    SELECT rn FROM (SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY emp_id, period ORDER BY processed_date, id) AS rn
+                    FROM payroll_history) AS runs WHERE runs.id = payroll_history.id)
+                 WHERE run_no IS NULL''')
+    # The unique index leads with (emp_id, period), so it replaces the plain one
+    c.execute("DROP INDEX IF EXISTS idx_history_emp_period")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_history_emp_period_run ON payroll_history (emp_id, period, run_no)")
+    # Answers "latest run of this period" (MAX(run_no) WHERE period=?) from the index alone
+    c.execute("CREATE INDEX IF NOT EXISTS idx_history_period_run ON payroll_history (period, run_no)")
+
+def _migrate_drop_period_emp_index(c):
+    # Every period lookup is served by idx_history_period_run now; (period, emp_id)
+    # only saved the sort in fetch_history_range and cost every archive write.
+    c.execute("DROP INDEX IF EXISTS idx_history_period_emp")
+
+MIGRATIONS = [
+    _migrate_base_tables,
+    _migrate_history_breakdown_columns,
+    _migrate_default_admin,
+    _migrate_history_period,
+    _migrate_history_runs,
+    _migrate_drop_period_emp_index,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+_migration_lock = threading.Lock()
+_startup_reports = {}
+
+def init_db():
+    """Apply pending migrations once per process; later calls (every rerun) do no SQL."""
+    report = _startup_reports.get(DB_NAME)
+    if report is not None:
+        return report
+    with _migration_lock:
+        if DB_NAME in _startup_reports:
+            return _startup_reports[DB_NAME]
+        started = time.perf_counter()
+        with get_connection() as conn:
+            c = conn.cursor()
+            from_version = c.execute("PRAGMA user_version").fetchone()[0]
+            applied = []
+            for version in range(from_version + 1, SCHEMA_VERSION + 1):
+                step = MIGRATIONS[version - 1]
+                # IMMEDIATE takes the write lock, so a second process racing us
+                # waits here and then sees the bumped user_version.
+                c.execute("BEGIN IMMEDIATE")
+                try:
+                    if c.execute("PRAGMA user_version").fetchone()[0] >= version:
+                        c.execute("COMMIT")
+                        continue
+                    step(c)
+                    c.execute(f"PRAGMA user_version = {version}")
+                    c.execute("COMMIT")
+                except Exception:
+                    c.execute("ROLLBACK")
+                    logging.error(f"MIGRATION FAILED: step {version} ({step.__name__})")
+                    raise
+                applied.append(step.__name__)
+        report = {
+            'from_version': from_version,
+            'to_version': max(from_version, SCHEMA_VERSION),
+            'applied': applied,
+            'elapsed_ms': (time.perf_counter() - started) * 1000,
+        }
+        _startup_reports[DB_NAME] = report
+        if applied:
+            logging.info(f"MIGRATION: Schema v{from_version} -> v{SCHEMA_VERSION} "
+                         f"({', '.join(applied)}) in {report['elapsed_ms']:.1f} ms.")
+        return report
+
+def get_startup_report():
+    """Result of the first init_db() call in this process, or None before it ran."""
+    return _startup_reports.get(DB_NAME)
 
 # --- USER MANAGEMENT ---
+@timed('db.add_user')
 def add_user(username, password, role):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
     try:
-        c.execute("INSERT INTO users VALUES (?, ?, ?)", (username, hash_password(password), role))
-        conn.commit()
+        with get_connection() as conn:
+            conn.execute("INSERT INTO users VALUES (?, ?, ?)", (username, hash_password(password), role))
         logging.info(f"ADMIN ACTION: New user '{username}' ({role}) created.")
         return True
-    except: 
+    except sqlite3.Error: 
         return False
-    finally: 
-        conn.close()
 
+@timed('db.get_all_users', rows=len)
 def get_all_users():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql("SELECT username, role FROM users", conn)
-    conn.close()
-    return df
+    with get_connection() as conn:
+        return pd.read_sql("SELECT username, role FROM users", conn)
 
+@timed('db.delete_user')
 def delete_user(username):
     if username == 'admin': return False 
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM users WHERE username=?", (username,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute("DELETE FROM users WHERE username=?", (username,))
     logging.warning(f"ADMIN ACTION: User '{username}' deleted.")
     return True
 
+@timed('db.login_user')
 def login_user(username, password):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT role FROM users WHERE username=? AND password=?", (username, hash_password(password)))
-    user = c.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        user = conn.execute("SELECT role FROM users WHERE username=? AND password=?", 
+                            (username, hash_password(password))).fetchone()
     if user:
         logging.info(f"LOGIN: User '{username}' logged in.")
         return user[0]
     return None
 
 # --- EMPLOYEE MANAGEMENT ---
+# Bumped by every successful employee write; invalidates the in-memory master
+# table below and any payroll result computed against an older version.
+_employee_version = 0
+_employee_version_lock = threading.Lock()
+
+def _bump_employee_version():
+    global _employee_version
+    with _employee_version_lock:
+        _employee_version += 1
+
+def get_employee_master_version():
+    return _employee_version
+
+@timed('db.add_employee')
 def add_employee(emp_id, name, desig, dept, nic, bank, acc_no, date):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
     try:
-        c.execute('INSERT INTO employees VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (emp_id, name, desig, dept, nic, bank, acc_no, date))
-        conn.commit()
+        with get_connection() as conn:
+            conn.execute('INSERT INTO employees VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (emp_id, name, desig, dept, nic, bank, acc_no, date))
+        _bump_employee_version()
         logging.info(f"Employee Added: {emp_id}")
         return True
-    except: 
+    except sqlite3.Error: 
         return False
-    finally: 
-        conn.close()
 
+@timed('db.update_employee')
 def update_employee(emp_id, name, desig, dept, nic, bank, acc_no, date):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('UPDATE employees SET name=?, designation=?, department=?, nic=?, bank_name=?, account_no=?, joined_date=? WHERE emp_id=?', 
-              (name, desig, dept, nic, bank, acc_no, date, emp_id))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute('UPDATE employees SET name=?, designation=?, department=?, nic=?, bank_name=?, account_no=?, joined_date=? WHERE emp_id=?', 
+                     (name, desig, dept, nic, bank, acc_no, date, emp_id))
+    _bump_employee_version()
     logging.info(f"Employee Updated: {emp_id}")
 
+@timed('db.delete_employee')
 def delete_employee(emp_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM employees WHERE emp_id=?", (emp_id,))
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        conn.execute("DELETE FROM employees WHERE emp_id=?", (emp_id,))
+    _bump_employee_version()
     logging.warning(f"Employee Deleted: {emp_id}")
 
+EMPLOYEE_COLUMNS = ['emp_id', 'name', 'designation', 'department', 'nic', 'bank_name', 'account_no', 'joined_date']
+
+@timed('db.upsert_employees', rows=lambda r: r['inserted'] + r['updated'])
+def upsert_employees(inserts, updates):
+    """Apply a bulk import atomically: inserts and updates are iterables of row
+    tuples in EMPLOYEE_COLUMNS order. Both executemany calls share one transaction,
+    so an ID added by someone else in the meantime rolls the whole import back.
+    Returns {'inserted', 'updated'}.
+    """
+    inserts, updates = list(inserts), list(updates)
+    insert_sql = f"INSERT INTO employees ({', '.join(EMPLOYEE_COLUMNS)}) VALUES ({', '.join('?' * len(EMPLOYEE_COLUMNS))})"
+    update_sql = (f"UPDATE employees SET {', '.join(f'{col}=?' for col in EMPLOYEE_COLUMNS[1:])} WHERE emp_id=?")
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(insert_sql, inserts)
+        conn.executemany(update_sql, (row[1:] + row[:1] for row in updates))
+    if inserts or updates:
+        _bump_employee_version()
+    logging.info(f"Employee Import: {len(inserts)} added, {len(updates)} updated.")
+    return {'inserted': len(inserts), 'updated': len(updates)}
+
+# Read-through cache of the master table, shared by all sessions. An entry is
+# valid while _employee_version is unchanged, i.e. until the next employee write.
+_employee_cache = {}
+
+def _employee_master():
+    entry = _employee_cache.get(DB_NAME)
+    if entry is None or entry['version'] != _employee_version:
+        # Read the version before querying: a write racing with us can only make
+        # the entry look older than it is, never newer.
+        version = _employee_version
+        with span('db.load_employees') as info, get_connection() as conn:
+            cursor = conn.execute("SELECT * FROM employees")
+            rows = cursor.fetchall()
+            info['rows'] = len(rows)
+        # by_id keeps the sqlite3 tuples, so NULL stays None as fetchone() returned
+        # it; read back from the frame it would be NaN (and saved as "nan" on edit)
+        df = pd.DataFrame(rows, columns=[d[0] for d in cursor.description])
+        entry = {'version': version, 'df': df, 'by_id': {row[0]: row for row in rows}}
+        _employee_cache[DB_NAME] = entry
+    return entry
+
 def get_all_employees():
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql("SELECT * FROM employees", conn)
-    conn.close()
-    return df
+    return _employee_master()['df'].copy()
 
 def get_employee_by_id(emp_id):
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT * FROM employees WHERE emp_id=?", (emp_id,))
-    data = c.fetchone()
-    conn.close()
-    return data
+    return _employee_master()['by_id'].get(emp_id)
 
 # --- HISTORY ---
-def save_payroll_to_db(df, month, year):
-    conn = sqlite3.connect(DB_NAME)
-    db_data = df.copy()
-    db_data['month'] = month
-    db_data['year'] = year
-    db_data['processed_date'] = datetime.now()
+HISTORY_COLUMNS = [
+    ('Employee ID', 'emp_id'), ('Name', 'emp_name'), ('Basic salary', 'basic_salary'), 
+    ('Gross Salary', 'gross_salary'), ('Nopay Amount', 'nopay_amount'), ('Total_Tax', 'total_tax'), 
+    ('EPF_Employee_Amt', 'epf_employee'), ('Total Deduction', 'total_deduction'), ('Net Salary', 'net_salary'), 
+    ('EPF_Company_Amt', 'epf_company'), ('ETF_Company_Amt', 'etf_company'),
+]
+
+@timed('db.get_archived_runs')
+def get_archived_runs(month, year):
+    """Run numbers already archived for month/year (empty list if none)."""
+    with get_connection() as conn:
+        rows = conn.execute("SELECT DISTINCT run_no FROM payroll_history WHERE period=? ORDER BY run_no", 
+                            (period_key(month, year),)).fetchall()
+    return [r[0] for r in rows]
+
+@timed('db.save_payroll_to_db', rows=lambda r: r['rows'])
+def save_payroll_to_db(df, month, year, mode='replace'):
+    """Archive a payroll result atomically.
+
+    mode='replace' swaps out every earlier run of the month; mode='version' keeps
+    them and stores this one as the next run number. Rows go in with a single
+    executemany inside one transaction, so a failure leaves the archive untouched.
+    Returns {'rows', 'run_no', 'replaced'}.
+    """
+    if mode not in ('replace', 'version'):
+        raise ValueError(f"Unknown archive mode '{mode}' (expected 'replace' or 'version')")
+    period = period_key(month, year)
+    processed_date = datetime.now().isoformat(sep=' ')
+
+    subset = df[[src for src, _ in HISTORY_COLUMNS]]
+    # Python scalars (and None for NaN) bind cleanly in sqlite3
+    subset = subset.astype(object).where(subset.notna(), None)
     
-    subset = db_data[[
-        'Employee ID', 'Name', 'month', 'year', 'Basic salary', 'Gross Salary', 
-        'Nopay Amount', 'Total_Tax', 'EPF_Employee_Amt', 'Total Deduction', 
-        'Net Salary', 'EPF_Company_Amt', 'ETF_Company_Amt', 'processed_date'
-    ]]
-    subset.columns = [
-        'emp_id', 'emp_name', 'month', 'year', 'basic_salary', 'gross_salary', 
-        'nopay_amount', 'total_tax', 'epf_employee', 'total_deduction', 
-        'net_salary', 'epf_company', 'etf_company', 'processed_date'
-    ]
-    subset.to_sql('payroll_history', conn, if_exists='append', index=False)
-    conn.close()
-    logging.info(f"ARCHIVE: Payroll saved for {month} {year}.")
-
-def fetch_history(month, year):
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql("SELECT * FROM payroll_history WHERE month=? AND year=?", conn, params=(month, year))
-    conn.close()
-    return df
\ No newline at end of file
+    columns = [dst for _, dst in HISTORY_COLUMNS] + ['month', 'year', 'period', 'run_no', 'processed_date']
+    insert_sql = f"INSERT INTO payroll_history ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    with get_connection() as conn:
+        # IMMEDIATE: no other writer can archive this month between reading and writing run_no
+        conn.execute("BEGIN IMMEDIATE")
+        replaced = 0
+        if mode == 'replace':
+            replaced = conn.execute("DELETE FROM payroll_history WHERE period=?", (period,)).rowcount
+            run_no = 1
+        else:
+            run_no = conn.execute("SELECT COALESCE(MAX(run_no), 0) + 1 FROM payroll_history WHERE period=?", 
+                                  (period,)).fetchone()[0]
+        tail = (month, int(year), period, run_no, processed_date)
+        conn.executemany(insert_sql, (row + tail for row in subset.itertuples(index=False, name=None)))
+    logging.info(f"ARCHIVE: Payroll saved for {month} {year} (run {run_no}, {len(subset)} rows, "
+                 f"{mode}{f', {replaced} rows replaced' if replaced else ''}).")
+    return {'rows': len(subset), 'run_no': run_no, 'replaced': replaced}
+
+# Latest run of the row's own period, from the (period, run_no) index alone.
+# INDEXED BY keeps the planner from walking the month through another index
+# for every row when there are no ANALYZE statistics.
+_LATEST_RUN = ("run_no = (SELECT MAX(latest.run_no) FROM payroll_history AS latest "
+               "INDEXED BY idx_history_period_run WHERE latest.period = payroll_history.period)")
+
+def _history_query(month, year, all_runs=False):
+    sql = "SELECT * FROM payroll_history WHERE period=?"
+    if not all_runs:
+        sql += f" AND {_LATEST_RUN}"
+    return sql, (period_key(month, year),)
+
+def _history_range_query(start_period, end_period, emp_id=None, all_runs=False):
+    if emp_id is None:
+        sql = "SELECT * FROM payroll_history WHERE period BETWEEN ? AND ?"
+        params = (start_period, end_period)
+    else:
+        sql = "SELECT * FROM payroll_history WHERE emp_id=? AND period BETWEEN ? AND ?"
+        params = (emp_id, start_period, end_period)
+    if not all_runs:
+        sql += f" AND {_LATEST_RUN}"
+    sql += " ORDER BY period, emp_id" if emp_id is None else " ORDER BY period"
+    return sql, params
+
+@timed('db.fetch_history', rows=len)
+def fetch_history(month, year, all_runs=False):
+    sql, params = _history_query(month, year, all_runs)
+    with get_connection() as conn:
+        return pd.read_sql(sql, conn, params=params)
+
+@timed('db.fetch_history_range', rows=len)
+def fetch_history_range(start_period, end_period, emp_id=None, all_runs=False):
+    """Archived rows with start_period <= period <= end_period (YYYYMM), optionally for one employee.
+
+    Only the latest run of each month is returned unless all_runs is set. Served by
+    idx_history_period_run, or idx_history_emp_period_run when emp_id is given.
+    """
+    sql, params = _history_range_query(start_period, end_period, emp_id, all_runs)
+    with get_connection() as conn:
+        return pd.read_sql(sql, conn, params=params)
@@ -0,0 +1,89 @@
+import logging
+import time
+import numpy as np
+import pandas as pd
+from database import EMPLOYEE_COLUMNS, get_all_employees, upsert_employees
+from ingest import read_employee_sheet
+from validation import validate_employee_sheet, has_errors
+
+# --- BULK EMPLOYEE IMPORT ---
+# read -> validate -> diff against the master -> one upsert transaction.
+# A blank cell in the sheet keeps the stored value, so a sheet with only
+# 'Employee ID' and 'Bank' columns updates bank names and nothing else.
+
+def plan_employee_import(df_import, df_master):
+    """Split an import into inserts / updates / unchanged against the master table.
+
+    Returns {'insert': DataFrame, 'update': DataFrame, 'unchanged': int,
+    'changes': DataFrame(emp_id, column, old, new)}; the insert and update frames
+    hold complete EMPLOYEE_COLUMNS rows as they will be written. An update row
+    differs from the stored one exactly in its 'changes' entries: every other
+    column keeps the stored value, NULL included.
+    """
+    fields = [col for col in EMPLOYEE_COLUMNS[1:] if col in df_import.columns]
+    stored = df_master.set_index('emp_id')[EMPLOYEE_COLUMNS[1:]]
+    # compared as text, so a NULL and a blank cell count as the same
+    master = stored.fillna('').astype(str)
+    incoming = df_import.set_index('emp_id')
+    existing = incoming.index.isin(master.index)
+
+    inserts = incoming.loc[~existing].reindex(columns=EMPLOYEE_COLUMNS[1:], fill_value='').reset_index()
+
+    old = master.loc[incoming.index[existing]]
+    new = old.copy()
+    if fields:
+        sheet = incoming.loc[existing, fields]
+        new[fields] = sheet.where(sheet != '', old[fields])
+    differs = new != old
+    changed = differs.any(axis=1).to_numpy()
+
+    rows, cols = np.nonzero(differs.to_numpy())
+    changes = pd.DataFrame({
+        'emp_id': new.index.to_numpy()[rows],
+        'column': new.columns.to_numpy()[cols],
+        'old': old.to_numpy()[rows, cols],
+        'new': new.to_numpy()[rows, cols],
+    })
+    # Write the stored row with only the changed cells replaced, so an untouched
+    # NULL column isn't rewritten as '' behind the dry run's back
+    kept = stored.loc[new.index[changed]].astype(object)
+    written = kept.where(kept.notna(), None).where(~differs[changed], new[changed])
+    return {'insert': inserts[EMPLOYEE_COLUMNS], 'update': written.reset_index()[EMPLOYEE_COLUMNS],
+            'unchanged': int((~changed).sum()), 'changes': changes}
+
+def apply_employee_import(plan):
+    """Write a plan from plan_employee_import in one transaction."""
+    return upsert_employees(plan['insert'].itertuples(index=False, name=None),
+                            plan['update'].itertuples(index=False, name=None))
+
+def import_employees(source, fmt='xlsx', dry_run=True):
+    """Read, validate and plan an employee sheet, and apply it unless dry_run or invalid.
+
+    Returns {'report', 'plan', 'applied', 'rows', 'seconds': {read, plan, apply}, 'rows_per_second'}.
+    Nothing is written when the validation report has errors.
+    """
+    seconds = {}
+    started = time.perf_counter()
+    df_import = read_employee_sheet(source, fmt)
+    seconds['read'] = time.perf_counter() - started
+
+    t = time.perf_counter()
+    df_master = get_all_employees()
+    report = validate_employee_sheet(df_import, df_master)
+    plan = None if has_errors(report) else plan_employee_import(df_import, df_master)
+    seconds['plan'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    applied = plan is not None and not dry_run
+    if applied:
+        apply_employee_import(plan)
+    seconds['apply'] = time.perf_counter() - t
+
+    total = time.perf_counter() - started
+    result = {'report': report, 'plan': plan, 'applied': applied, 'rows': len(df_import), 'seconds': seconds,
+              'rows_per_second': len(df_import) / total if total else 0.0}
+    if plan is not None:
+        logging.info(f"Employee Import{' (dry run)' if dry_run else ''}: {len(df_import)} rows -> "
+                     f"{len(plan['insert'])} new, {len(plan['update'])} changed, {plan['unchanged']} unchanged "
+                     f"in {total:.2f}s.")
+    return result
@@ -0,0 +1,258 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from cache import LRUCache
+from metrics import timed
+from processor import NUMERIC_COLS
+from database import EMPLOYEE_COLUMNS
+
+# --- INPUT SCHEMA ---
+# Every input format is mapped onto the same typed frame: 'Employee ID' as
+# stripped strings plus float64 amounts. Columns the calculation doesn't read
+# are skipped while parsing, except 'Other Earnings', which the payslip prints.
+ID_COLUMN = 'Employee ID'
+AMOUNT_COLUMNS = NUMERIC_COLS + ['Other Earnings']
+FINANCE_COLUMNS = [ID_COLUMN] + AMOUNT_COLUMNS
+
+# Extra spellings accepted for a canonical column, beyond case/space/underscore
+# differences (which are always ignored).
+COLUMN_ALIASES = {
+    'Employee ID': ['emp id', 'employee no', 'emp no', 'empid'],
+}
+
+def _normalize_header(header):
+    return re.sub(r'[\s_]+', ' ', str(header).strip().lower())
+
+_CANONICAL = {_normalize_header(col): col for col in FINANCE_COLUMNS}
+_CANONICAL.update({_normalize_header(alias): col for col, aliases in COLUMN_ALIASES.items() for alias in aliases})
+
+def canonical_column(header):
+    """Canonical FINANCE_COLUMNS name for a source header, or None if the column is not used."""
+    return _CANONICAL.get(_normalize_header(header)) if header is not None else None
+
+CHUNK_ROWS = 5000
+
+_last_ingest_stats = {}
+
+def _coerce_chunk(df, first_row, stats):
+    """Apply the schema dtypes to a chunk whose columns are already canonical."""
+    for col in df.columns:
+        if col == ID_COLUMN:
+            df[col] = df[col].map(lambda v: '' if v is None or v != v else str(v).strip())
+        elif df[col].dtype != 'float64':
+            numeric = pd.to_numeric(df[col], errors='coerce')
+            bad = numeric.isna() & df[col].notna()
+            if bad.any():
+                positions = np.flatnonzero(bad.to_numpy())
+                stats['non_numeric_cells'] += len(positions)
+                stats['non_numeric_samples'].extend((first_row + int(i), col, df[col].iloc[i]) for i in positions[:5])
+                stats['invalid_cells'].setdefault(col, []).extend(first_row + int(i) for i in positions)
+            df[col] = numeric.astype('float64')
+    df.index = pd.RangeIndex(first_row, first_row + len(df))
+    return df
+
+def _map_headers(headers, stats):
+    """[(position, canonical name)] for the headers the schema uses; first match wins."""
+    keep, seen = [], set()
+    for i, header in enumerate(headers):
+        col = canonical_column(header)
+        if col and col not in seen:
+            keep.append((i, col))
+            seen.add(col)
+        elif header is not None and str(header).strip():
+            stats['skipped_columns'].append(str(header))
+    return keep
+
+# --- FORMAT READERS ---
+# Each yields raw DataFrame chunks with canonical column names; iter_finance_chunks
+# applies the shared dtype coercion.
+def _read_xlsx(source, chunk_size, stats):
+    # openpyxl read-only mode materializes one row at a time instead of the
+    # whole workbook object model
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        keep = _map_headers(next(rows, ()), stats)
+        columns = [col for _, col in keep]
+        chunk = []
+        for row in rows:
+            # read-only sheets can report trailing formatted-but-empty rows
+            if all(v is None for v in row):
+                continue
+            chunk.append([row[i] if i < len(row) else None for i, _ in keep])
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame.from_records(chunk, columns=columns)
+                chunk = []
+        yield pd.DataFrame.from_records(chunk, columns=columns)
+    finally:
+        wb.close()
+
+def _read_csv(source, chunk_size, stats):
+    headers = list(pd.read_csv(source, nrows=0).columns)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    keep = _map_headers(headers, stats)
+    usecols = [headers[i] for i, _ in keep]
+    renames = {headers[i]: col for i, col in keep}
+    # IDs stay text so values like 00123 keep their leading zeros
+    id_dtype = {src: str for src, col in renames.items() if col == ID_COLUMN}
+    for chunk in pd.read_csv(source, usecols=usecols, dtype=id_dtype, chunksize=chunk_size):
+        yield chunk.rename(columns=renames)[[col for _, col in keep]]
+
+def _read_parquet(source, chunk_size, stats):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet input needs the optional 'pyarrow' package (pip install pyarrow).")
+    pf = pq.ParquetFile(source)
+    keep = _map_headers(pf.schema_arrow.names, stats)
+    names = pf.schema_arrow.names
+    for batch in pf.iter_batches(batch_size=chunk_size, columns=[names[i] for i, _ in keep]):
+        yield batch.to_pandas().set_axis([col for _, col in keep], axis=1)
+
+INPUT_FORMATS = {
+    'xlsx': _read_xlsx,
+    'csv': _read_csv,
+    'parquet': _read_parquet,
+}
+
+def detect_format(filename):
+    """Input format for a file name, from its extension."""
+    ext = os.path.splitext(str(filename))[1].lower().lstrip('.')
+    fmt = {'pq': 'parquet'}.get(ext, ext)
+    if fmt not in INPUT_FORMATS:
+        raise ValueError(f"Unsupported input file '{filename}' (expected one of: {', '.join(INPUT_FORMATS)})")
+    return fmt
+
+def iter_finance_chunks(source, fmt='xlsx', chunk_size=CHUNK_ROWS, stats=None):
+    """Stream a finance sheet in any INPUT_FORMATS as typed DataFrame chunks.
+
+    Columns are renamed to FINANCE_COLUMNS names; IDs are read as stripped
+    strings and amounts as float64. Cells that are not numbers become NaN and are
+    counted in stats['non_numeric_cells'], with their row indexes per column in
+    stats['invalid_cells']. Chunk indexes continue across chunks.
+    """
+    if fmt not in INPUT_FORMATS:
+        raise ValueError(f"Unknown input format '{fmt}' (expected one of: {', '.join(INPUT_FORMATS)})")
+    stats = stats if stats is not None else {}
+    stats.update({'format': fmt, 'rows': 0, 'chunks': 0, 'non_numeric_cells': 0, 
+                  'non_numeric_samples': [], 'invalid_cells': {}, 'skipped_columns': []})
+    for chunk in INPUT_FORMATS[fmt](source, chunk_size, stats):
+        if len(chunk) == 0 and stats['chunks'] > 0:
+            continue
+        yield _coerce_chunk(chunk, stats['rows'], stats)
+        stats['rows'] += len(chunk)
+        stats['chunks'] += 1
+
+@timed('ingest.read_finance_workbook', rows=len)
+def read_finance_workbook(source, fmt='xlsx', chunk_size=CHUNK_ROWS, measure_memory=False):
+    """Whole finance sheet via iter_finance_chunks; figures land in get_last_ingest_stats().
+
+    measure_memory=True traces the Python heap peak while reading (slower).
+    """
+    started_tracing = measure_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if measure_memory:
+        tracemalloc.reset_peak()
+    stats = {}
+    started = time.perf_counter()
+    try:
+        chunks = list(iter_finance_chunks(source, fmt, chunk_size, stats))
+        df = pd.concat(chunks) if chunks else pd.DataFrame(columns=[ID_COLUMN])
+        # Kept on the frame for validation.py: the NaNs alone can't tell a blank
+        # cell from text in an amount column
+        df.attrs['invalid_cells'] = {col: tuple(rows) for col, rows in stats['invalid_cells'].items()}
+    finally:
+        peak = tracemalloc.get_traced_memory()[1] if measure_memory else None
+        if started_tracing:
+            tracemalloc.stop()
+    elapsed = time.perf_counter() - started
+    stats.update({'seconds': elapsed, 'rows_per_second': stats['rows'] / elapsed if elapsed else 0.0,
+                  'peak_traced_bytes': peak})
+    _last_ingest_stats.clear()
+    _last_ingest_stats.update(stats)
+    logging.info(f"INGEST: Read {stats['rows']} {fmt} rows in {elapsed:.2f}s "
+                 f"({stats['rows_per_second']:,.0f} rows/s, {stats['non_numeric_cells']} non-numeric cells).")
+    return df
+
+def get_last_ingest_stats():
+    return dict(_last_ingest_stats)
+
+# --- EMPLOYEE SHEETS ---
+# Bulk imports of the employee master (see employee_import.py). Every cell is
+# read as text, like the Add Employee form; headers map onto EMPLOYEE_COLUMNS.
+EMPLOYEE_HEADERS = {
+    'emp_id': ['employee id', 'emp id', 'employee no', 'emp no', 'empid'],
+    'name': ['name', 'full name', 'employee name'],
+    'designation': ['designation', 'position', 'title'],
+    'department': ['department', 'dept'],
+    'nic': ['nic', 'nic no', 'nic number'],
+    'bank_name': ['bank name', 'bank'],
+    'account_no': ['account no', 'account', 'account number'],
+    'joined_date': ['joined date', 'date joined', 'join date'],
+}
+_EMPLOYEE_CANONICAL = {_normalize_header(alias): col for col, aliases in EMPLOYEE_HEADERS.items() for alias in aliases}
+_EMPLOYEE_CANONICAL.update({_normalize_header(col): col for col in EMPLOYEE_COLUMNS})
+
+def _employee_cell(value):
+    if value is None or value != value:
+        return ''
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, float) and value.is_integer():
+        # account numbers typed into Excel come back as 123456.0
+        return str(int(value))
+    return str(value).strip()
+
+def read_employee_sheet(source, fmt='xlsx'):
+    """Employee rows from an xlsx/csv sheet as a DataFrame of stripped strings.
+
+    Only the recognised columns are kept, under their EMPLOYEE_COLUMNS names;
+    blank cells are ''. Columns missing from the sheet are missing from the frame.
+    """
+    if fmt == 'xlsx':
+        wb = load_workbook(source, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            headers = list(next(rows, ()))
+            records = [row for row in rows if not all(v is None for v in row)]
+        finally:
+            wb.close()
+        df = pd.DataFrame.from_records(records, columns=range(len(headers))) if records else pd.DataFrame(columns=range(len(headers)))
+        df.columns = headers
+    elif fmt == 'csv':
+        df = pd.read_csv(source, dtype=str, keep_default_na=False)
+    else:
+        raise ValueError(f"Unsupported employee sheet format '{fmt}' (expected xlsx or csv)")
+
+    keep = {}
+    for header in df.columns:
+        col = _EMPLOYEE_CANONICAL.get(_normalize_header(header)) if header is not None else None
+        if col and col not in keep.values():
+            keep[header] = col
+    df = df[list(keep)].set_axis(list(keep.values()), axis=1)
+    for col in df.columns:
+        df[col] = df[col].map(_employee_cell).astype(object)
+    return df.reset_index(drop=True)
+
+# --- UPLOAD MEMOIZATION ---
+# Shared by all sessions: the same uploaded bytes are parsed once.
+_input_cache = LRUCache(max_entries=8)
+
+def parse_finance_upload(file_bytes, fmt='xlsx'):
+    """(sha256 of the bytes, parsed finance sheet), parsing each distinct upload once."""
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    df = _input_cache.get_or_create((digest, fmt), lambda: read_finance_workbook(io.BytesIO(file_bytes), fmt))
+    return digest, df
+
+def get_ingest_cache_stats():
+    return _input_cache.stats()
@@ -0,0 +1,140 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import multiprocessing.util
+import os
+import queue
+import sys
+import threading
+from datetime import date, datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# --- LOG LOCATION ---
+# One log for the app, the CLI and the benchmarks: system.log next to the app (or the .exe)
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+else:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+LOG_FILE = os.path.join(base_dir, "system.log")
+LOG_LEVEL = logging.INFO
+LOG_MAX_BYTES = 5 * 1024 * 1024   # roll over at 5 MB ...
+LOG_BACKUPS = 10                  # ... or at the first record of a new day; keep system.log.1 .. .10
+
+# Fields every LogRecord has; anything else on a record (logging.info(..., extra={...})) is written as-is
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'user'}
+
+# Logged-in user of the current Streamlit session (each session runs in its own thread)
+_log_user = contextvars.ContextVar('log_user', default=None)
+
+def set_log_user(username):
+    """Tag records logged from the current thread/context with username."""
+    _log_user.set(username)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, user, msg, plus exc and any extra fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'user': getattr(record, 'user', None),
+            'msg': record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _STANDARD_ATTRS})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class DailyRotatingFileHandler(RotatingFileHandler):
+    """RotatingFileHandler that also rolls over on the first record of a new day (if daily)."""
+
+    def __init__(self, filename, max_bytes, backup_count, daily=True):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.daily = daily
+        self._day = date.fromtimestamp(os.path.getmtime(filename)) if os.path.exists(filename) else date.today()
+
+    def shouldRollover(self, record):
+        if self.daily and date.fromtimestamp(record.created) != self._day and os.path.exists(self.baseFilename):
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._day = date.today()
+
+class _ContextQueueHandler(QueueHandler):
+    # Runs in the logging thread: resolve the message, traceback and user here,
+    # so the writer thread only formats and writes plain data.
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.user = _log_user.get()
+        return record
+
+_setup_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+def _file_handler(path, rotate=True):
+    handler = DailyRotatingFileHandler(path, LOG_MAX_BYTES if rotate else 0, LOG_BACKUPS, daily=rotate)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+def _start_listener(path, rotate=True):
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _listener = QueueListener(log_queue, _file_handler(path, rotate), respect_handler_level=True)
+    _listener.start()
+    return log_queue
+
+def _after_fork_in_child():
+    # The parent's writer thread doesn't exist in a forked worker: give the child
+    # its own. Only the parent rotates, so two processes never rename the file at once.
+    global _listener, _setup_lock
+    if _queue_handler is not None:
+        _setup_lock = threading.Lock()   # may have been held by another parent thread at fork time
+        _listener = None
+        _queue_handler.queue = _start_listener(_queue_handler.log_path, rotate=False)
+        # multiprocessing workers leave through os._exit (no atexit), but do run its finalizers
+        multiprocessing.util.Finalize(None, shutdown_logging, exitpriority=10)
+
+def configure_logging(path=LOG_FILE, level=LOG_LEVEL):
+    """Route the root logger through a queue to a background JSON writer. Idempotent.
+
+    Callers only pay for putting the record on an in-memory queue; the file write,
+    JSON encoding and rotation happen on the listener thread.
+    """
+    global _queue_handler
+    with _setup_lock:
+        root = logging.getLogger()
+        # by name, so a re-imported copy of this module doesn't add a second handler
+        if any(h.get_name() == 'payroll_queue' for h in root.handlers):
+            return
+        # Spawned workers (CLI batch, PDF pool) re-import this module: only the
+        # main process may rotate, or two processes could rename the file at once
+        _queue_handler = _ContextQueueHandler(_start_listener(path, rotate=multiprocessing.parent_process() is None))
+        _queue_handler.set_name('payroll_queue')
+        _queue_handler.log_path = path
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+        atexit.register(shutdown_logging)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def shutdown_logging():
+    """Write out everything still queued and stop the writer thread."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
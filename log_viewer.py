@@ -0,0 +1,260 @@
+import glob
+import hashlib
+import itertools
+import json
+import os
+import re
+import threading
+from datetime import date
+import numpy as np
+
+# --- TAIL ---
+def tail_lines(path, n=50, block_size=64 * 1024):
+    """Last n lines of a text file, reading backwards from the end in blocks."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b''
+        # n newlines (plus the file's trailing one) are enough, however big the file is
+        while pos > 0 and data.count(b'\n') <= n:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    return [line.decode('utf-8', errors='replace') for line in data.splitlines()[-n:]]
+
+def parse_line(line):
+    """{'ts', 'level', 'user', 'msg'} for a JSON log line (log_setup) or a pre-JSON
+    'asctime - LEVEL - message' line; unparseable lines come back as the message."""
+    try:
+        entry = json.loads(line)
+        if isinstance(entry, dict):
+            return entry
+    except ValueError:
+        pass
+    match = _PLAIN_LINE.match(line)
+    if match:
+        return {'ts': match['ts'], 'level': match['level'], 'user': None, 'msg': match['msg']}
+    return {'ts': None, 'level': None, 'user': None, 'msg': line.rstrip('\n')}
+
+_PLAIN_LINE = re.compile(r'(?P<ts>\d{4}-\d\d-\d\d[ T][\d:,.]+) - (?P<level>[A-Z]+) - (?P<msg>.*)')
+
+# --- OFFSET INDEX ---
+# One entry per line of a log file: byte offset, day (YYYYMMDD), level and user.
+# Saved next to the live log under the hash of the file's first bytes
+# (system.log.<head>.idx.npz), not under its name. Rotation renames
+# system.log -> .1 -> .2 ..., and a renamed file keeps its index. Only the bytes
+# appended since the last refresh are parsed; a truncated file is re-indexed.
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+_HEAD_BYTES = 256
+
+def _file_head(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(_HEAD_BYTES)).hexdigest()
+
+class _PagedSearch:
+    def page(self, page_no, page_size=100, newest_first=True, **filters):
+        """(parsed entries of one page, total matching lines) for search(**filters)."""
+        with self._lock:
+            matches = self.search(**filters)
+            if newest_first:
+                matches = matches[::-1]
+            lines = self.read_lines(matches[page_no * page_size:(page_no + 1) * page_size])
+        return [parse_line(line) for line in lines], len(matches)
+
+class LogIndex(_PagedSearch):
+    """Line-offset index of one log file for paging and level/user/date filters."""
+
+    def __init__(self, path, index_base=None):
+        self.path = path
+        self.index_base = index_base or path
+        self._lock = threading.RLock()
+        self._reset()
+
+    @property
+    def index_path(self):
+        return f"{self.index_base}.{self.head[:16]}.idx.npz"
+
+    def _reset(self, head=''):
+        self.size = 0
+        self.head = head
+        self.users = []
+        self.offsets = np.empty(0, dtype=np.int64)
+        self.days = np.empty(0, dtype=np.int32)
+        self.levels = np.empty(0, dtype=np.int8)
+        self.user_ids = np.empty(0, dtype=np.int32)
+
+    def _load(self):
+        try:
+            with np.load(self.index_path) as saved:
+                meta = json.loads(str(saved['meta']))
+                if meta['head'] != self.head:
+                    return
+                self.offsets, self.days = saved['offsets'], saved['days']
+                self.levels, self.user_ids = saved['levels'], saved['user_ids']
+            self.size, self.users = meta['size'], meta['users']
+        except (OSError, KeyError, ValueError):
+            self._reset(self.head)
+
+    def _save(self):
+        meta = json.dumps({'size': self.size, 'head': self.head, 'users': self.users})
+        tmp_path = f"{self.index_base}.{self.head[:16]}.idx.tmp.npz"
+        np.savez(tmp_path, meta=np.array(meta), offsets=self.offsets, days=self.days,
+                 levels=self.levels, user_ids=self.user_ids)
+        os.replace(tmp_path, self.index_path)
+
+    def _user_id(self, user):
+        if user is None:
+            return -1
+        if user not in self.users:
+            self.users.append(user)
+        return self.users.index(user)
+
+    def refresh(self):
+        """Index whatever was appended to the log since the last refresh; returns the line count."""
+        with self._lock:
+            if not os.path.exists(self.path):
+                self._reset()
+                return 0
+            with open(self.path, 'rb') as f:
+                head = hashlib.sha1(f.read(_HEAD_BYTES)).hexdigest()
+                size = os.fstat(f.fileno()).st_size
+                if head != self.head:
+                    self._reset(head)
+                    self._load()
+                if size < self.size:
+                    self._reset(head)
+                if size == self.size:
+                    return len(self.offsets)
+                f.seek(self.size)
+                chunk = f.read(size - self.size)
+            # only complete lines; a half-written last line is picked up next time
+            chunk = chunk[:chunk.rfind(b'\n') + 1]
+            offsets, days, levels, user_ids = [], [], [], []
+            pos = self.size
+            for raw in chunk.splitlines(keepends=True):
+                entry = parse_line(raw.decode('utf-8', errors='replace'))
+                ts, level = entry.get('ts') or '', entry.get('level')
+                offsets.append(pos)
+                days.append(int(ts[:10].replace('-', '')) if ts[:4].isdigit() else 0)
+                levels.append(LEVELS.index(level) if level in LEVELS else -1)
+                user_ids.append(self._user_id(entry.get('user')))
+                pos += len(raw)
+            if offsets:
+                self.offsets = np.concatenate([self.offsets, np.array(offsets, dtype=np.int64)])
+                self.days = np.concatenate([self.days, np.array(days, dtype=np.int32)])
+                self.levels = np.concatenate([self.levels, np.array(levels, dtype=np.int8)])
+                self.user_ids = np.concatenate([self.user_ids, np.array(user_ids, dtype=np.int32)])
+                self.size = pos
+                self._save()
+            return len(self.offsets)
+
+    def search(self, levels=None, user=None, start=None, end=None):
+        """Line numbers (oldest first) matching every given filter; start/end are dates, inclusive."""
+        with self._lock:
+            mask = np.ones(len(self.offsets), dtype=bool)
+            if levels:
+                mask &= np.isin(self.levels, [LEVELS.index(level) for level in levels])
+            if user is not None:
+                mask &= self.user_ids == (self.users.index(user) if user in self.users else -2)
+            if start is not None:
+                mask &= self.days >= int(start.strftime('%Y%m%d'))
+            if end is not None:
+                mask &= self.days <= int(end.strftime('%Y%m%d'))
+            return np.flatnonzero(mask)
+
+    def read_lines(self, line_numbers):
+        """The given lines, each read with one seek; no other part of the file is loaded."""
+        lines = []
+        with self._lock, open(self.path, 'rb') as f:
+            ends = np.append(self.offsets[1:], self.size)
+            for i in line_numbers:
+                f.seek(self.offsets[i])
+                lines.append(f.read(ends[i] - self.offsets[i]).decode('utf-8', errors='replace').rstrip('\n'))
+        return lines
+
+    def first_day(self):
+        """Date of the oldest indexed line, or None."""
+        known = self.days[self.days > 0]
+        if not len(known):
+            return None
+        day = int(known.min())
+        return date(day // 10000, day // 100 % 100, day % 100)
+
+class LogHistory(_PagedSearch):
+    """The live log and its rotated backups (path.1, path.2, ...) searched as one
+    file, oldest line first. Each file is parsed once; after a rotation the
+    renamed files are matched to their existing indexes by head hash."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self.files = []   # LogIndex per file, oldest first
+
+    def refresh(self):
+        """Pick up rotations and appended lines; returns the total line count."""
+        with self._lock:
+            paths = [self.path]
+            while os.path.exists(f"{self.path}.{len(paths)}"):
+                paths.append(f"{self.path}.{len(paths)}")
+            known = {index.head: index for index in self.files}
+            files = []
+            for path in reversed(paths):
+                try:
+                    index = known.get(_file_head(path)) or LogIndex(path, self.path)
+                except OSError:   # rotated away since the listing; next refresh sees it
+                    continue
+                index.path = path
+                index.refresh()
+                files.append(index)
+            self.files = files
+            self._prune()
+            return sum(len(index.offsets) for index in files)
+
+    def _prune(self):
+        # indexes of backups that rotated out of the set, and the old name-keyed system.log.idx.npz
+        keep = {index.index_path for index in self.files}
+        for stale in glob.glob(f"{glob.escape(self.path)}.*.idx.npz") + [f"{self.path}.idx.npz"]:
+            if stale not in keep and os.path.exists(stale):
+                os.remove(stale)
+
+    @property
+    def users(self):
+        return list(dict.fromkeys(user for index in self.files for user in index.users))
+
+    def _starts(self):
+        return np.cumsum([0] + [len(index.offsets) for index in self.files])
+
+    def search(self, **filters):
+        """Line numbers across all files (oldest first) matching LogIndex.search(**filters)."""
+        with self._lock:
+            starts = self._starts()
+            parts = [index.search(**filters) + start for index, start in zip(self.files, starts)]
+            return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def read_lines(self, line_numbers):
+        """The given lines, in the order given, each file opened once per run of its lines."""
+        with self._lock:
+            starts = self._starts()
+            owners = np.searchsorted(starts, line_numbers, side='right') - 1
+            lines = []
+            for k, run in itertools.groupby(zip(owners, line_numbers), key=lambda pair: pair[0]):
+                lines += self.files[k].read_lines([n - starts[k] for _, n in run])
+            return lines
+
+    def first_day(self):
+        days = [day for day in (index.first_day() for index in self.files) if day]
+        return min(days) if days else None
+
+# One history per live log, shared by every session
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_log_index(path):
+    """The LogHistory for path and its backups, refreshed to the current end of the log."""
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = LogHistory(path)
+    index.refresh()
+    return index
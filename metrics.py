@@ -0,0 +1,128 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:   # Windows (the packaged .exe): no peak-RSS figures
+    resource = None
+
+# --- METRICS LOCATION ---
+# write_prometheus() defaults to metrics.prom next to the app (or the .exe), where
+# a node_exporter textfile collector can pick it up.
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+else:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+METRICS_FILE = os.path.join(base_dir, "metrics.prom")
+
+# --- SPANS ---
+# One aggregate per span name (e.g. 'db.fetch_history', 'processor.merge'),
+# shared by every session in the process. Spans recorded inside worker
+# processes stay in those processes unless the parent record()s them.
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+def _after_fork_in_child():
+    # A forked worker (the PDF pool under Streamlit) may have been copied while
+    # another session's thread held the lock; it would block in record() forever.
+    global _metrics_lock
+    _metrics_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None where unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024   # Linux reports KiB
+
+def record(name, seconds, rows=None, rss_growth=None):
+    """Add one finished span to the aggregate for name."""
+    with _metrics_lock:
+        m = _metrics.get(name)
+        if m is None:
+            m = _metrics[name] = {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'last_seconds': 0.0,
+                                  'rows': 0, 'last_rows': None, 'rss_growth_bytes': 0}
+        m['calls'] += 1
+        m['seconds'] += seconds
+        m['max_seconds'] = max(m['max_seconds'], seconds)
+        m['last_seconds'] = seconds
+        if rows is not None:
+            m['rows'] += rows
+            m['last_rows'] = rows
+        if rss_growth:
+            m['rss_growth_bytes'] += rss_growth
+
+@contextmanager
+def span(name, rows=None):
+    """Time the block as span name. Yields a dict; set ['rows'] inside the block if
+    the row count is only known at the end. Exceptions are recorded too."""
+    info = {'rows': rows}
+    peak_before = peak_rss_bytes()
+    started = time.perf_counter()
+    try:
+        yield info
+    finally:
+        elapsed = time.perf_counter() - started
+        # growth of the process peak is charged to the span that caused it
+        rss_growth = peak_rss_bytes() - peak_before if peak_before is not None else None
+        record(name, elapsed, info['rows'], rss_growth)
+
+def timed(name, rows=None):
+    """Decorator form of span; rows may be a function of the return value (e.g. len)."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name) as info:
+                result = fn(*args, **kwargs)
+                if rows is not None:
+                    info['rows'] = rows(result)
+                return result
+        return wrapper
+    return decorate
+
+def get_metrics():
+    """{span name: aggregate} snapshot, sorted by name."""
+    with _metrics_lock:
+        return {name: dict(m) for name, m in sorted(_metrics.items())}
+
+def reset_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+
+# --- EXPORT ---
+_PROMETHEUS_SERIES = [
+    ('payroll_span_calls_total', 'counter', 'calls', "Completed spans."),
+    ('payroll_span_seconds_total', 'counter', 'seconds', "Time spent in spans."),
+    ('payroll_span_seconds_max', 'gauge', 'max_seconds', "Slowest single span."),
+    ('payroll_span_rows_total', 'counter', 'rows', "Rows handled by spans that report a row count."),
+    ('payroll_span_rss_growth_bytes_total', 'counter', 'rss_growth_bytes', "Growth of the process peak RSS during spans."),
+]
+
+def prometheus_text():
+    """All spans in the Prometheus text exposition format."""
+    snapshot = get_metrics()
+    lines = []
+    for metric, kind, key, help_text in _PROMETHEUS_SERIES:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{span="{name}"}} {m[key]}' for name, m in snapshot.items()]
+    peak = peak_rss_bytes()
+    if peak is not None:
+        lines += ["# HELP payroll_process_peak_rss_bytes Peak resident set size of the process.",
+                  "# TYPE payroll_process_peak_rss_bytes gauge", f"payroll_process_peak_rss_bytes {peak}"]
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path=METRICS_FILE):
+    """Write prometheus_text() atomically (temp file + rename), so a scraper never sees half a file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
+    return path
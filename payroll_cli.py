@@ -0,0 +1,175 @@
+"""Headless payroll runs for cron / batch jobs (no Streamlit).
+
+    python payroll_cli.py site_a.xlsx site_b.csv --month March --year 2026 --out-dir out/ --archive replace
+
+Each input file is read, validated and calculated in its own worker process and
+gets its own payslip ZIP (and optionally a combined PDF). With --archive, the
+results of all files are saved as one payroll run for the month, in a single
+transaction, once every worker has finished - and only if none of them failed
+and no employee appears in more than one file.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from database import init_db, get_all_employees, save_payroll_to_db, MONTHS, HISTORY_COLUMNS
+from ingest import read_finance_workbook, detect_format
+from validation import validate_payroll_input, has_errors
+from processor import process_payroll_data, MONEY_MODES
+from pdf_gen import generate_zip_payslips, generate_combined_payslips, ZIP_COMPRESSION_METHODS, ZIP_COMPRESSION
+
+# Sidebar settings, as flags; anything not given falls back to --config, then to the app defaults
+CONFIG_FLAGS = [
+    ('working_days', int), ('stamps_fee', float), ('epf_emp_rate', float),
+    ('epf_co_rate', float), ('etf_co_rate', float), ('money_mode', str),
+]
+
+def output_stems(paths):
+    """One output file name stem per input path, unique within the batch.
+
+    site_a.xlsx -> site_a; inputs sharing a stem (a.csv, a.xlsx) get their
+    extension appended (a_csv, a_xlsx), and any still alike (site1/payroll.xlsx,
+    site2/payroll.xlsx) their 1-based position in paths (payroll_xlsx_1, payroll_xlsx_2).
+    """
+    stems = [os.path.splitext(os.path.basename(p))[0] for p in paths]
+    counts = Counter(stems)
+    stems = [f"{stem}_{os.path.splitext(p)[1].lstrip('.').lower()}" if counts[stem] > 1 else stem
+             for stem, p in zip(stems, paths)]
+    counts = Counter(stems)
+    return [f"{stem}_{i}" if counts[stem] > 1 else stem for i, stem in enumerate(stems, start=1)]
+
+def run_file(path, month, year, config, out_dir, combined=False, compression=ZIP_COMPRESSION, pdf_workers=1, stem=None):
+    """Read, validate and calculate one finance sheet and write its payslips.
+
+    Outputs are named after stem (default: the file name without extension).
+    Returns a summary dict; 'history' holds the rows to archive (None if the file failed).
+    """
+    started = time.perf_counter()
+    stem = stem or os.path.splitext(os.path.basename(path))[0]
+    summary = {'file': path, 'ok': False, 'rows': 0, 'outputs': [], 'history': None, 'error': None}
+    try:
+        df_input = read_finance_workbook(path, detect_format(path))
+        report = validate_payroll_input(df_input, get_all_employees(), config)
+        if not report.empty:
+            report_path = os.path.join(out_dir, f"{stem}_validation.csv")
+            report.to_csv(report_path, index=False)
+            summary['outputs'].append(report_path)
+        if has_errors(report):
+            raise ValueError(f"{int((report['severity'] == 'error').sum())} validation error(s), see {report_path}")
+
+        df_final = process_payroll_data(df_input, config)
+        zip_path = os.path.join(out_dir, f"{stem}_Payslips_{month}_{year}.zip")
+        zip_file = generate_zip_payslips(df_final, month, year, workers=pdf_workers, compression=compression)
+        with zip_file, open(zip_path, 'wb') as f:
+            shutil.copyfileobj(zip_file, f)
+        summary['outputs'].append(zip_path)
+        if combined:
+            pdf_path = os.path.join(out_dir, f"{stem}_Payslips_{month}_{year}.pdf")
+            with open(pdf_path, 'wb') as f:
+                f.write(generate_combined_payslips(df_final, month, year))
+            summary['outputs'].append(pdf_path)
+
+        summary.update({'ok': True, 'rows': len(df_final), 'net_total': float(df_final['Net Salary'].sum()),
+                        'history': df_final[[src for src, _ in HISTORY_COLUMNS]]})
+    except Exception as e:
+        summary['error'] = str(e)
+        logging.error(f"CLI: {path} failed: {e}")
+    summary['seconds'] = time.perf_counter() - started
+    return summary
+
+def run_batch(paths, month, year, config, out_dir, workers=None, combined=False,
+              compression=ZIP_COMPRESSION, archive=None):
+    """run_file over every path, in parallel worker processes when there is more than one.
+
+    archive ('replace' or 'version') saves all files as one run for the month, only if every file
+    succeeded and no employee ID appears in two of them.
+    Returns (summaries in input order, archive result): the archive result is None without archive,
+    else save_payroll_to_db's dict plus 'ok': True, or {'ok': False, 'error': ...} if nothing was saved.
+    """
+    init_db()
+    os.makedirs(out_dir, exist_ok=True)
+    stems = output_stems(paths)
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        # one file at a time: let the payslip renderer use every core instead
+        summaries = [run_file(p, month, year, config, out_dir, combined, compression, pdf_workers=None, stem=stem)
+                     for p, stem in zip(paths, stems)]
+    else:
+        # spawn, not fork: workers start clean instead of inheriting the parent's
+        # SQLite connections and logging thread (and behave as on Windows)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(run_file, p, month, year, config, out_dir, combined, compression, stem=stem)
+                       for p, stem in zip(paths, stems)]
+            summaries = [f.result() for f in futures]
+
+    if not archive:
+        return summaries, None
+    # a partial or doubled-up month in the archive is worse than none
+    if not all(s['ok'] for s in summaries):
+        error = "some files failed"
+    else:
+        history = pd.concat([s['history'] for s in summaries], ignore_index=True)
+        # each file was validated on its own, so IDs repeated across files are only caught here
+        repeated = history['Employee ID'][history['Employee ID'].duplicated()].unique()
+        error = (f"{len(repeated)} employee ID(s) appear in more than one file: {', '.join(map(str, repeated[:10]))}"
+                 if len(repeated) else None)
+    if error is None:
+        try:
+            return summaries, {'ok': True, **save_payroll_to_db(history, month, year, mode=archive)}
+        except Exception as e:
+            error = f"archive failed: {e}"
+    logging.error(f"CLI: Nothing archived for {month} {year}; {error}.")
+    return summaries, {'ok': False, 'error': error}
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run payroll for one or more finance sheets without the web UI.")
+    parser.add_argument('files', nargs='+', help="finance sheets (.xlsx, .csv, .parquet)")
+    parser.add_argument('--month', required=True, choices=MONTHS)
+    parser.add_argument('--year', required=True, type=int)
+    parser.add_argument('--out-dir', default='.', help="where ZIPs, PDFs and validation reports are written")
+    parser.add_argument('--config', help="JSON file with calculation settings (working_days, stamps_fee, ...)")
+    for key, type_ in CONFIG_FLAGS:
+        parser.add_argument(f"--{key.replace('_', '-')}", dest=key, type=type_,
+                            choices=MONEY_MODES if key == 'money_mode' else None)
+    parser.add_argument('--workers', type=int, help="parallel files (default: one per CPU)")
+    parser.add_argument('--compression', choices=list(ZIP_COMPRESSION_METHODS), default=ZIP_COMPRESSION)
+    parser.add_argument('--combined', action='store_true', help="also write one print-ready PDF per file")
+    parser.add_argument('--archive', choices=['replace', 'version'], help="save the results to the history database")
+    parser.add_argument('--json', action='store_true', help="print the summary as JSON")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = _parse_args(argv)
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config.update(json.load(f))
+    config.update({key: getattr(args, key) for key, _ in CONFIG_FLAGS if getattr(args, key) is not None})
+
+    summaries, archived = run_batch(args.files, args.month, args.year, config, args.out_dir, workers=args.workers,
+                                    combined=args.combined, compression=args.compression, archive=args.archive)
+    for s in summaries:
+        s.pop('history')
+    if args.json:
+        print(json.dumps({'files': summaries, 'archive': archived}, indent=2))
+    else:
+        for s in summaries:
+            status = f"{s['rows']} employees, net {s['net_total']:,.2f}" if s['ok'] else f"FAILED: {s['error']}"
+            print(f"{s['file']}: {status} ({s['seconds']:.1f}s)")
+        if archived and archived['ok']:
+            print(f"Archived {archived['rows']} rows as run {archived['run_no']} of {args.month} {args.year}.")
+        elif archived:
+            print(f"NOT ARCHIVED: {archived['error']}")
+    ok = all(s['ok'] for s in summaries) and (archived is None or archived['ok'])
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
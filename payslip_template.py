@@ -0,0 +1,234 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import sys
+from datetime import date
+
+# --- TEMPLATE LOCATION ---
+# An optional payslip_template.json next to the app (or the .exe) overrides any
+# key of DEFAULT_TEMPLATE, e.g. just {"company": {"phone": ...}}: nested blocks
+# are merged key by key, lists (details, earnings, ...) are replaced whole.
+if getattr(sys, 'frozen', False):
+    base_dir = os.path.dirname(sys.executable)
+else:
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+TEMPLATE_FILE = os.path.join(base_dir, "payslip_template.json")
+
+DEFAULT_TEMPLATE = {
+    "company": {
+        "name": "Pitch Capital (Pvt) Ltd",
+        "address": "540/18/2, Diyawanna Addara, Pitakotte Road, Thalawathugoda, 10116",
+        "phone": "0112091610",
+    },
+    "font": "helvetica",
+    # Page geometry in mm (A4, default 10mm margins)
+    "left_x": 10, "right_x": 110, "line_end_x": 200, "top_y": 10,
+    # Employee details: (label, format string over the result row's columns)
+    "details": [
+        ["Employee Name", "{Name}"],
+        ["Employee ID/EPF No", "{Employee ID}"],
+        ["Designation", "{designation}"],
+        ["Department", "{department}"],
+        ["NIC No", "{nic}"],
+        ["Bank & Account No", "{bank_name} - {account_no}"],
+    ],
+    # Money rows: (label, result column); a null column prints 0.00
+    "earnings": [
+        ["Basic Salary", "Basic salary"],
+        ["Reimbursement Allowance", "Reimburse allowances"],
+        ["Travelling Allowance", "Travelling allowances"],
+        ["Overtime", None],
+        ["Commission", None],
+        ["Bonus", None],
+        ["Other Earnings", "Other Earnings"],
+    ],
+    "deductions": [
+        ["No Pay", "Nopay Amount"],
+        ["EPF - Employee (8%)", "EPF_Employee_Amt"],
+        ["APIT", "Total_Tax"],
+        ["Loan", "Loan installment"],
+        ["Loan Interest", "Loan interest"],
+        ["Salary Advance", "Salary advances"],
+        ["Other Deductions", "Others"],
+        ["Stamp Duty", "Stamps_Final"],
+    ],
+    "totals": {"earnings": "Gross Salary", "deductions": "Total Deduction", "net": "Net Salary"},
+    "employer": [
+        ["EPF - Employer (12%)", "EPF_Company_Amt"],
+        ["ETF - Employer (3%)", "ETF_Company_Amt"],
+    ],
+    "declaration": {"title": "Declaration", "signature_label": "Authorized by:"},
+}
+
+class _RowFields(dict):
+    # Missing columns render as blanks, like data.get(col, '') did
+    def __missing__(self, key):
+        return ''
+
+def _money(column):
+    if column is None:
+        return lambda data: "0.00"
+    return lambda data: f"{data.get(column, 0):,.2f}"
+
+def _formatted(fmt):
+    return lambda data: fmt.format_map(_RowFields(data))
+
+class CompiledTemplate:
+    """A payslip layout resolved once into absolute drawing operations.
+
+    compile_template() walks the layout a single time, working out every
+    coordinate and font change, and splits the result into static operations
+    (headings, labels, company details, rules) and field operations that read the
+    employee row. render() just replays both lists onto the current page.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self.fingerprint = hashlib.sha256(json.dumps(template, sort_keys=True).encode()).hexdigest()[:16]
+        self.static_ops = []
+        self.field_ops = []
+        self._compile()
+
+    # --- compile-time helpers: mimic FPDF's flowing cursor ---
+    def _static(self, op, *args):
+        self.static_ops.append((op, args))
+
+    def _field(self, x, y, w, h, value_fn, align='L', font=None):
+        self.field_ops.append((font or self._font, x, y, w, h, value_fn, align))
+
+    def _set_font(self, style, size):
+        self._font = (self.template['font'], style, size)
+        self._static('font', *self._font)
+
+    def _compile(self):
+        t = self.template
+        left, right, line_end = t['left_x'], t['right_x'], t['line_end_x']
+        y = t['top_y']
+
+        def rule(y):
+            self._static('line', left, y, line_end, y)
+
+        # --- 1. HEADER SECTION ---
+        self._set_font('B', 12)
+        self._static('cell', left, y, 0, 5, 'EMPLOYEE PAY SLIP', 'C'); y += 5 + 2
+        self._set_font('B', 14)
+        self._static('cell', left, y, 0, 5, t['company']['name'], 'C'); y += 5 + 2
+        self._set_font('', 9)
+        self._static('cell', left, y, 0, 4, t['company']['address'], 'C'); y += 4
+        self._static('cell', left, y, 0, 4, t['company']['phone'], 'C'); y += 4 + 5
+
+        self._set_font('', 10)
+        self._field(left, y, 30, 5, lambda data: f"Month / Year: {data['__month__']} {data['__year__']}"); y += 5
+        self._field(left, y, 30, 5, lambda data: f"Date Issued: {data['__issued__']}"); y += 5 + 2
+        rule(y); y += 5
+
+        # --- 2. EMPLOYEE DETAILS ---
+        self._set_font('B', 11)
+        self._static('cell', left, y, 0, 6, "Employee Details", 'L'); y += 6
+        self._set_font('', 10)
+        for label, fmt in t['details']:
+            self._static('cell', left, y, 45, 6, label, 'L')
+            self._static('cell', left + 45, y, 5, 6, ":", 'L')
+            self._field(left + 50, y, 0, 6, _formatted(fmt))
+            y += 6
+        y += 5; rule(y); y += 5
+
+        # --- 3. FINANCIALS TABLE (Earnings | Deductions) ---
+        self._set_font('B', 10)
+        self._static('text', left, y, "Earnings")
+        self._static('text', right, y, "Deductions")
+        y += 8
+        self._set_font('', 10)
+        line_height = 6
+        for x, rows in ((left, t['earnings']), (right, t['deductions'])):
+            for i, (label, column) in enumerate(rows):
+                self._static('cell', x, y + i * line_height, 60, line_height, label, 'L')
+                self._field(x + 60, y + i * line_height, 30, line_height, _money(column), 'R')
+        y += max(len(t['earnings']), len(t['deductions'])) * line_height + 2
+
+        # --- TOTALS ---
+        self._set_font('B', 10)
+        self._static('cell', left, y, 60, 8, "Total Earnings (A)", 'L')
+        self._field(left + 60, y, 30, 8, _money(t['totals']['earnings']), 'R')
+        self._static('cell', right, y, 60, 8, "Total Deductions (B)", 'L')
+        self._field(right + 60, y, 30, 8, _money(t['totals']['deductions']), 'R')
+        y += 8 + 5
+
+        # --- NET PAY ---
+        self._set_font('B', 12)
+        self._static('cell', left, y, 60, 8, "Net Pay", 'L')
+        self._field(left + 60, y, 30, 8, _money(t['totals']['net']), 'R')
+        y += 8 + 5; rule(y); y += 5
+
+        # --- 4. EMPLOYER CONTRIBUTIONS ---
+        self._set_font('B', 10)
+        self._static('cell', left, y, 0, 6, "Employer Contributions (For Information)", 'L'); y += 6
+        self._set_font('', 10)
+        for label, column in t['employer']:
+            self._static('cell', left, y, 60, 6, label, 'L')
+            self._field(left + 60, y, 30, 6, _money(column), 'R')
+            y += 6
+        y += 5; rule(y); y += 10
+
+        # --- 5. FOOTER / DECLARATION ---
+        self._set_font('B', 10)
+        self._static('cell', left, y, 0, 6, t['declaration']['title'], 'L'); y += 6 + 15
+        self._static('cell', left, y, 30, 6, t['declaration']['signature_label'], 'L')
+        self._static('cell', left + 30, y, 60, 6, "_" * 30, 'L')
+
+    def render(self, pdf, data, month, year):
+        """Draw one payslip for the row dict data on the current page of pdf."""
+        for op, args in self.static_ops:
+            if op == 'cell':
+                x, y, w, h, text, align = args
+                pdf.set_xy(x, y)
+                pdf.cell(w, h, text, 0, 0, align)
+            elif op == 'font':
+                pdf.set_font(*args)
+            elif op == 'text':
+                pdf.text(*args)
+            elif op == 'line':
+                pdf.line(*args)
+        fields = dict(data, __month__=month, __year__=year, __issued__=date.today().strftime('%Y-%m-%d'))
+        for font, x, y, w, h, value_fn, align in self.field_ops:
+            pdf.set_font(*font)
+            pdf.set_xy(x, y)
+            pdf.cell(w, h, value_fn(fields), 0, 0, align)
+
+def _merge(base, override):
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            _merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+def load_template(path=TEMPLATE_FILE):
+    """DEFAULT_TEMPLATE with the JSON file at path merged over it."""
+    template = copy.deepcopy(DEFAULT_TEMPLATE)
+    if path and os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                _merge(template, json.load(f))
+        except (OSError, ValueError, AttributeError) as e:
+            logging.error(f"TEMPLATE: Could not load {path}, using defaults: {e}")
+    return template
+
+_compiled = {}
+
+def get_compiled_template(path=TEMPLATE_FILE):
+    """Compiled template for path, recompiled only when the file's mtime changes."""
+    mtime = os.path.getmtime(path) if path and os.path.exists(path) else None
+    cached = _compiled.get(path)
+    if cached is None or cached[0] != mtime:
+        try:
+            compiled = CompiledTemplate(load_template(path))
+        except Exception as e:
+            # a bad template must not stop payslips going out
+            logging.error(f"TEMPLATE: Could not compile {path}, using defaults: {e}")
+            compiled = CompiledTemplate(copy.deepcopy(DEFAULT_TEMPLATE))
+        cached = _compiled[path] = (mtime, compiled)
+    return cached[1]
@@ -1,7 +1,53 @@
 from fpdf import FPDF
+import hashlib
 import io
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
+from itertools import repeat
+import pandas as pd
+from cache import LRUCache
+from metrics import span, record
+from payslip_template import get_compiled_template
+
+# Bulk rendering: below PARALLEL_MIN_ROWS payslips the process pool's start-up
+# cost outweighs the gain, so small batches render serially. DEFAULT_WORKERS
+# of None means one worker per CPU core.
+PARALLEL_MIN_ROWS = 200
+DEFAULT_WORKERS = None
+
+# Payslip PDFs already carry compressed page streams, so deflate mostly squeezes
+# fonts/metadata; it costs ~1-2% of render time. lzma is smaller but far slower.
+ZIP_COMPRESSION_METHODS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'lzma': zipfile.ZIP_LZMA,
+}
+ZIP_COMPRESSION = 'deflate'
+ZIP_COMPRESSLEVEL = 6   # deflate 0-9; ignored for stored/lzma
+
+# ZIP archives are built in memory up to this size, then spill to a temporary file
+ZIP_SPOOL_BYTES = 64 * 1024 * 1024
+
+# Bump whenever the payslip rendering code changes, so cached payslips drawn the
+# old way are not served again. Edits to payslip_template.json are picked up
+# automatically through the compiled template's fingerprint.
+TEMPLATE_VERSION = 2
+
+# Rendered ZIPs kept across reruns/sessions, keyed on the result frame's content
+_zip_cache = LRUCache(max_entries=4, max_bytes=512 * 1024 * 1024, sizeof=lambda f: f.seek(0, io.SEEK_END))
+# Individual quick-view payslips, keyed on the row's content hash
+_pdf_cache = LRUCache(max_entries=512)
+# Spooled ZIP files are shared between sessions; reads must not interleave
+_zip_read_lock = threading.Lock()
+_last_zip_stats = {}
+# Combined print-ready PDFs, same keying as the ZIP cache plus the page ordering
+_combined_cache = LRUCache(max_entries=4, max_bytes=256 * 1024 * 1024)
 
 class PDFPayslip(FPDF):
     def header(self):
@@ -12,174 +58,160 @@ class PDFPayslip(FPDF):
         pass
 
 def create_single_pdf(row, month, year):
-    data = row.to_dict()
+    # Accepts a pandas Series (quick-view) or a plain dict (pool workers)
+    data = row.to_dict() if hasattr(row, 'to_dict') else dict(row)
+    with span('pdf.render', rows=1):
+        return _render_pdf(data, month, year)
+
+def _render_pdf(data, month, year):
     pdf = PDFPayslip()
     pdf.add_page()
-    
-    # --- 1. HEADER SECTION ---
-    pdf.set_font('helvetica', 'B', 12)
-    pdf.cell(0, 5, 'EMPLOYEE PAY SLIP', ln=True, align='C')
-    pdf.ln(2)
-    
-    pdf.set_font('helvetica', 'B', 14)
-    pdf.cell(0, 5, 'Pitch Capital (Pvt) Ltd', ln=True, align='C') # You can change Company Name here
-    
-    pdf.set_font('helvetica', '', 9)
-    pdf.ln(2)
-    pdf.cell(0, 4, '540/18/2, Diyawanna Addara, Pitakotte Road, Thalawathugoda, 10116', ln=True, align='C')
-    pdf.cell(0, 4, '0112091610', ln=True, align='C')
-    
-    pdf.ln(5)
-    
-    # Month / Issued Date
-    pdf.set_font('helvetica', '', 10)
-    pdf.cell(30, 5, f"Month / Year: {month} {year}", ln=True)
-    pdf.cell(30, 5, f"Date Issued: {date.today().strftime('%Y-%m-%d')}", ln=True)
-    
-    pdf.ln(2)
-    pdf.line(10, pdf.get_y(), 200, pdf.get_y()) # Horizontal Line
-    pdf.ln(5)
-    
+    _draw_payslip(pdf, data, month, year)
+    return bytes(pdf.output())
 
-    # --- 2. EMPLOYEE DETAILS ---
-    pdf.set_font('helvetica', 'B', 11)
-    pdf.cell(0, 6, "Employee Details", ln=True)
-    pdf.set_font('helvetica', '', 10)
-    
-    # Helper for key-value layout
-    def add_detail(label, value):
-        pdf.cell(45, 6, label, 0, 0)
-        pdf.cell(5, 6, ":", 0, 0)
-        pdf.cell(0, 6, str(value), 0, 1)
-
-    add_detail("Employee Name", data.get('Name', ''))
-    add_detail("Employee ID/EPF No", data.get('Employee ID', ''))
-    add_detail("Designation", data.get('designation', ''))
-    add_detail("Department", data.get('department', ''))
-    add_detail("NIC No", data.get('nic', ''))
-    add_detail("Bank & Account No", f"{data.get('bank_name', '')} - {data.get('account_no', '')}")
-    
-    pdf.ln(5)
-    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
-    pdf.ln(5)
-    
-    
-    # --- 3. FINANCIALS TABLE (Earnings | Deductions) ---
-    pdf.set_font('helvetica', 'B', 10)
-    
-    # Table Headers
-    # We use explicit XY positioning to create two distinct columns
-    start_y = pdf.get_y()
-    left_col_x = 10
-    right_col_x = 110
-    
-    pdf.text(left_col_x, start_y, "Earnings")
-    pdf.text(right_col_x, start_y, "Deductions")
-    
-    pdf.ln(8)
-    curr_y = pdf.get_y()
-    
-    # Prepare Data Lists
-    earnings = [
-        ("Basic Salary", data.get('Basic salary', 0)),
-        ("Reimbursement Allowance", data.get('Reimburse allowances', 0)),
-        ("Travelling Allowance", data.get('Travelling allowances', 0)),
-        ("Overtime", 0.00), # Placeholder if not in excel
-        ("Commission", 0.00), # Placeholder
-        ("Bonus", 0.00), # Placeholder
-        ("Other Earnings", data.get('Other Earnings', 0)),
-    ]
-    
-    deductions = [
-        ("No Pay", data.get('Nopay Amount', 0)),
-        ("EPF - Employee (8%)", data.get('EPF_Employee_Amt', 0)),
-        ("APIT", data.get('Total_Tax', 0)),
-        ("Loan", data.get('Loan installment', 0)),
-        ("Loan Interest", data.get('Loan interest', 0)),
-        ("Salary Advance", data.get('Salary advances', 0)),
-        ("Other Deductions", data.get('Others', 0)),
-        ("Stamp Duty", data.get('Stamps_Final', 0)),
-    ]
-    
-    pdf.set_font('helvetica', '', 10)
-    
-    # Calculate Max Rows
-    max_rows = max(len(earnings), len(deductions))
-    line_height = 6
-    
-    for i in range(max_rows):
-        # LEFT COLUMN (Earnings)
-        if i < len(earnings):
-            lbl, val = earnings[i]
-            pdf.set_xy(left_col_x, curr_y + (i * line_height))
-            pdf.cell(60, line_height, lbl, 0, 0)
-            pdf.cell(30, line_height, f"{val:,.2f}", 0, 0, 'R')
-            
-        # RIGHT COLUMN (Deductions)
-        if i < len(deductions):
-            lbl, val = deductions[i]
-            pdf.set_xy(right_col_x, curr_y + (i * line_height))
-            pdf.cell(60, line_height, lbl, 0, 0)
-            pdf.cell(30, line_height, f"{val:,.2f}", 0, 0, 'R')
-            
-    # Move Cursor below table
-    final_y = curr_y + (max_rows * line_height) + 2
-    pdf.set_xy(10, final_y)
-    
-    # --- TOTALS ---
-    pdf.set_font('helvetica', 'B', 10)
-    
-    # Total Earnings
-    pdf.cell(60, 8, "Total Earnings (A)", 0, 0)
-    pdf.cell(30, 8, f"{data.get('Gross Salary', 0):,.2f}", 0, 0, 'R')
-    
-    # Total Deductions (Align Right side)
-    pdf.set_xy(right_col_x, final_y)
-    pdf.cell(60, 8, "Total Deductions (B)", 0, 0)
-    pdf.cell(30, 8, f"{data.get('Total Deduction', 0):,.2f}", 0, 1, 'R')
-    
-    pdf.ln(5)
-    
-    # --- NET PAY ---
-    pdf.set_font('helvetica', 'B', 12)
-    pdf.cell(60, 8, "Net Pay", 0, 0)
-    pdf.cell(30, 8, f"{data.get('Net Salary', 0):,.2f}", 0, 1, 'R')
-    
-    pdf.ln(5)
-    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
-    pdf.ln(5)
-    
-    # --- 4. EMPLOYER CONTRIBUTIONS ---
-    pdf.set_font('helvetica', 'B', 10)
-    pdf.cell(0, 6, "Employer Contributions (For Information)", ln=True)
-    pdf.set_font('helvetica', '', 10)
-    
-    pdf.cell(60, 6, "EPF - Employer (12%)", 0, 0)
-    pdf.cell(30, 6, f"{data.get('EPF_Company_Amt', 0):,.2f}", 0, 1, 'R')
-    
-    pdf.cell(60, 6, "ETF - Employer (3%)", 0, 0)
-    pdf.cell(30, 6, f"{data.get('ETF_Company_Amt', 0):,.2f}", 0, 1, 'R')
-    
-    pdf.ln(5)
-    pdf.line(10, pdf.get_y(), 200, pdf.get_y())
-    pdf.ln(10)
-    
-    # --- 5. FOOTER / DECLARATION ---
-    pdf.set_font('helvetica', 'B', 10)
-    pdf.cell(0, 6, "Declaration", ln=True)
-    pdf.ln(15) # Space for signature
-    
-    pdf.cell(30, 6, "Authorized by:", 0, 0)
-    pdf.cell(60, 6, "_" * 30, 0, 1)
+def _render_timed(data, month, year):
+    # Pool worker: no span here (it would stay in the worker and take its metrics
+    # lock); the time goes back to the parent, which records it as pdf.render
+    started = time.perf_counter()
+    pdf_content = _render_pdf(data, month, year)
+    return pdf_content, time.perf_counter() - started
 
-    return bytes(pdf.output())
+def _draw_payslip(pdf, data, month, year):
+    """Draw one employee's payslip on the current page of pdf."""
+    get_compiled_template().render(pdf, data, month, year)
+
+def generate_combined_payslips(df, month, year, group_by=None, sort_by='Employee ID'):
+    """Render every payslip as a page of one PDF document, for bulk printing.
+
+    Fonts and document overhead are shared by all pages and the file is written in a
+    single output call. group_by (e.g. 'department') keeps each group's pages together;
+    sort_by orders pages within a group. Missing columns are ignored.
+    """
+    keys = [col for col in (group_by, sort_by) if col and col in df.columns]
+    if keys:
+        df = df.sort_values(keys, kind='stable')
+    with span('pdf.combined', len(df)):
+        pdf = PDFPayslip()
+        for data in df.to_dict('records'):
+            pdf.add_page()
+            _draw_payslip(pdf, data, month, year)
+        return bytes(pdf.output())
+
+def _payslip_filename(data, index):
+    return f"{data.get('Employee ID', index)}_{str(data.get('Name', 'Emp')).replace(' ', '_')}.pdf"
+
+def _render_payslips(records, month, year, workers, parallel_min_rows):
+    """Yield PDF bytes in the same order as records, using a process pool for large batches."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(records) < parallel_min_rows:
+        for data in records:
+            yield create_single_pdf(data, month, year)
+        return
+    # Rows travel to the workers as plain dicts; chunking keeps IPC overhead low
+    chunksize = max(1, len(records) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for pdf_content, seconds in pool.map(_render_timed, records, repeat(month), repeat(year), chunksize=chunksize):
+            record('pdf.render', seconds, rows=1)
+            yield pdf_content
+
+def generate_zip_payslips(df, month, year, workers=DEFAULT_WORKERS, parallel_min_rows=PARALLEL_MIN_ROWS,
+                          spool_bytes=None, measure_memory=False,
+                          compression=ZIP_COMPRESSION, compresslevel=ZIP_COMPRESSLEVEL):
+    """Build the payslip ZIP and return it as a file-like object positioned at 0.
+
+    compression is one of ZIP_COMPRESSION_METHODS. In parallel mode the pool keeps
+    rendering later payslips while this process compresses the ones already
+    returned, so compression overlaps rendering instead of running after it.
+
+    The archive is written straight into a SpooledTemporaryFile, so anything above
+    spool_bytes (default ZIP_SPOOL_BYTES) lives on disk rather than in the process.
+    With measure_memory=True the Python heap peak is traced (slower) and reported
+    through get_last_zip_stats().
+    """
+    if compression not in ZIP_COMPRESSION_METHODS:
+        raise ValueError(f"Unknown ZIP compression '{compression}' (expected one of {', '.join(ZIP_COMPRESSION_METHODS)})")
+    if spool_bytes is None:
+        spool_bytes = ZIP_SPOOL_BYTES
+    started_tracing = measure_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if measure_memory:
+        tracemalloc.reset_peak()
+
+    records = df.to_dict('records')
+    filenames = [_payslip_filename(data, index) for index, data in zip(df.index, records)]
+    zip_file = tempfile.SpooledTemporaryFile(max_size=spool_bytes, suffix=".zip")
+    largest_entry = 0
+    try:
+        # pdf.zip covers the whole build; the pdf.render spans inside it are the rendering share
+        with span('pdf.zip', len(records)), \
+                zipfile.ZipFile(zip_file, "w", compression=ZIP_COMPRESSION_METHODS[compression],
+                                compresslevel=compresslevel if compression == 'deflate' else None) as zf:
+            # pool.map preserves input order, so entries always follow the frame's row order
+            for filename, pdf_content in zip(filenames, _render_payslips(records, month, year, workers, parallel_min_rows)):
+                zf.writestr(filename, pdf_content)
+                largest_entry = max(largest_entry, len(pdf_content))
+    finally:
+        peak = tracemalloc.get_traced_memory()[1] if measure_memory else None
+        if started_tracing:
+            tracemalloc.stop()
+
+    zip_size = zip_file.tell()
+    zip_file.seek(0)
+    _last_zip_stats.clear()
+    _last_zip_stats.update({
+        'entries': len(filenames), 'zip_bytes': zip_size, 'largest_entry_bytes': largest_entry,
+        'spilled_to_disk': zip_size > spool_bytes, 'peak_traced_bytes': peak, 'compression': compression,
+    })
+    return zip_file
+
+def get_last_zip_stats():
+    """Size, spill and (if measured) peak-memory figures for the most recent ZIP build."""
+    return dict(_last_zip_stats)
+
+def _template_key():
+    return f"{TEMPLATE_VERSION}:{get_compiled_template().fingerprint}"
+
+def _issue_day():
+    # Every payslip prints "Date Issued: <today>", so a cached one is stale the next day
+    return date.today().isoformat()
+
+def frame_fingerprint(df):
+    """Content hash of a result frame (values, index and column names)."""
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    h.update("\x1f".join(map(str, df.columns)).encode())
+    return h.hexdigest()
+
+def get_zip_payslips(df, month, year, compression=ZIP_COMPRESSION, compresslevel=ZIP_COMPRESSLEVEL):
+    """generate_zip_payslips, memoized per distinct (result frame, month, year, template, compression).
+
+    Returns the archive as bytes, which copies it out of the spooled file on every
+    call: call it when the user asks for the download, not on every rerun.
+    """
+    key = (frame_fingerprint(df), month, int(year), _template_key(), _issue_day(), compression, compresslevel)
+    zip_file = _zip_cache.get_or_create(key, lambda: generate_zip_payslips(
+        df, month, year, compression=compression, compresslevel=compresslevel))
+    with _zip_read_lock:
+        zip_file.seek(0)
+        return zip_file.read()
+
+def get_zip_cache_stats():
+    return _zip_cache.stats()
+
+def row_fingerprints(df):
+    """Per-row content hashes (Series aligned with df.index) for the quick-view PDF cache."""
+    columns_hash = hashlib.sha256("\x1f".join(map(str, df.columns)).encode()).hexdigest()[:16]
+    row_hashes = pd.util.hash_pandas_object(df, index=False)
+    return row_hashes.map(lambda h: f"{columns_hash}:{h:016x}")
+
+def get_single_pdf(row, month, year, fingerprint):
+    """create_single_pdf, rendered on first request and then served from the per-row cache."""
+    key = (fingerprint, month, int(year), _template_key(), _issue_day())
+    return _pdf_cache.get_or_create(key, lambda: create_single_pdf(row, month, year))
 
-def generate_zip_payslips(df, month, year):
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w") as zf:
-        for index, row in df.iterrows():
-            pdf_content = create_single_pdf(row, month, year)
-            filename = f"{row.get('Employee ID', index)}_{str(row.get('Name', 'Emp')).replace(' ', '_')}.pdf"
-            zf.writestr(filename, pdf_content)
-    zip_buffer.seek(0)
-    return zip_buffer
\ No newline at end of file
+def get_combined_payslips(df, month, year, group_by=None):
+    """generate_combined_payslips, memoized like get_zip_payslips."""
+    key = (frame_fingerprint(df), month, int(year), _template_key(), _issue_day(), group_by)
+    return _combined_cache.get_or_create(key, lambda: generate_combined_payslips(df, month, year, group_by=group_by))
@@ -1,11 +1,265 @@
+import numpy as np
 import pandas as pd
 import logging
-from database import get_all_employees
+from cache import LRUCache
+from metrics import span, timed
+from log_setup import configure_logging
+from database import get_all_employees, get_employee_master_version
 
 # Configure Logging (Ensures it writes to the same file)
-logging.basicConfig(filename='system.log', level=logging.INFO, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+configure_logging()
 
+# Finance-sheet amounts the calculation reads; missing columns count as 0
+NUMERIC_COLS = [
+    'Basic salary', 'Reimburse allowances', 'Travelling allowances', 
+    'Nopay days', 'Salary adjustment', 'Tax rate', 'APIT', 
+    'Salary advances', 'Loan installment', 'Loan interest', 'Others', 'Stamps fee'
+]
+
+# --- FORMULA ENGINE ---
+# Every derived column is declared once with the inputs it reads (finance
+# columns or other formulas) and the config keys it depends on. The evaluation
+# order comes from the dependency graph, and each formula is a whole-column
+# NumPy expression, so one pass computes the entire payroll.
+FORMULAS = {}
+
+def formula(name, inputs, config=(), output=True, rounding=None):
+    """Register fn(values, cfg) as the formula for column `name`; output=False keeps it internal.
+
+    rounding names the ROUNDING_MODES rule that brings the result back to whole
+    cents in 'cents' money mode; formulas that only add or select amounts need none.
+    """
+    def register(fn):
+        FORMULAS[name] = {'inputs': tuple(inputs), 'config': tuple(config), 'output': output,
+                          'rounding': rounding, 'fn': fn}
+        return fn
+    return register
+
+# --- FIXED-POINT MONEY ---
+# With money_mode='cents' every amount is an int64 count of cents: inputs and the
+# stamps fee are rounded to the cent once on the way in, sums and differences stay
+# exact, and each formula that multiplies or divides an amount rounds its own
+# result with an explicit rule:
+#   Nopay Amount  basic * nopay days / working days, computed unrounded and then
+#                 rounded half-up once (no per-day rounding)
+#   Total_Tax     liable salary * tax rate rounded half-up, then APIT added
+#   EPF / ETF     basic * rate rounded half-up, employee and employer separately
+# Half-up means half away from zero. Products are first snapped to 1e-6 of a cent
+# so that binary noise (e.g. 6255 * 0.1 = 625.4999...) cannot move a true half.
+# Outputs are converted back to float rupees, so every component is a whole
+# number of cents and Net Salary equals the printed components exactly.
+MONEY_MODES = ('float', 'cents')
+MONEY_COLS = [col for col in NUMERIC_COLS if col not in ('Nopay days', 'Tax rate')]
+MONEY_CONFIG = ('stamps_fee',)
+
+def _round_half_up(x):
+    return np.copysign(np.floor(np.abs(x) + 0.5), x)
+
+ROUNDING_MODES = {
+    'half_up': _round_half_up,
+    'half_even': np.rint,
+    'down': np.trunc,
+}
+
+def _to_cents(amounts, rounding='half_up'):
+    """Round (float) cent amounts to int64 cents with the named rule."""
+    return ROUNDING_MODES[rounding](np.round(np.asarray(amounts, dtype='float64'), 6)).astype('int64')
+
+# Earnings
+@formula('Gross Salary', ['Basic salary', 'Reimburse allowances', 'Travelling allowances'])
+def _gross_salary(v, cfg):
+    return v['Basic salary'] + v['Reimburse allowances'] + v['Travelling allowances']
+
+# Deductions
+@formula('Nopay Amount', ['Basic salary', 'Nopay days'], config=['working_days'], rounding='half_up')
+def _nopay_amount(v, cfg):
+    return (v['Basic salary'] / cfg['working_days']) * v['Nopay days']
+
+@formula('Liable Salary', ['Gross Salary', 'Nopay Amount', 'Salary adjustment'], output=False)
+def _liable_salary(v, cfg):
+    return v['Gross Salary'] - v['Nopay Amount'] - v['Salary adjustment']
+
+@formula('Total_Tax', ['Liable Salary', 'Tax rate', 'APIT'], rounding='half_up')
+def _total_tax(v, cfg):
+    return v['Liable Salary'] * v['Tax rate'] + v['APIT']
+
+@formula('EPF_Employee_Amt', ['Basic salary'], config=['epf_emp_rate'], rounding='half_up')
+def _epf_employee(v, cfg):
+    return v['Basic salary'] * cfg['epf_emp_rate']
+
+@formula('Stamps_Final', ['Stamps fee'], config=['stamps_fee'])
+def _stamps_final(v, cfg):
+    # Per-employee fee when given, otherwise the global fee
+    return np.where(v['Stamps fee'] > 0, v['Stamps fee'], cfg['stamps_fee'])
+
+@formula('Total Deduction', ['Nopay Amount', 'Salary adjustment', 'Total_Tax', 'EPF_Employee_Amt', 'Salary advances',
+                             'Loan installment', 'Loan interest', 'Others', 'Stamps_Final'])
+def _total_deduction(v, cfg):
+    return (v['Nopay Amount'] + v['Salary adjustment'] + v['Total_Tax'] + v['EPF_Employee_Amt'] + v['Salary advances'] + 
+            v['Loan installment'] + v['Loan interest'] + v['Others'] + v['Stamps_Final'])
+
+@formula('Net Salary', ['Gross Salary', 'Total Deduction'])
+def _net_salary(v, cfg):
+    return v['Gross Salary'] - v['Total Deduction']
+
+# Employer contributions
+@formula('EPF_Company_Amt', ['Basic salary'], config=['epf_co_rate'], rounding='half_up')
+def _epf_company(v, cfg):
+    return v['Basic salary'] * cfg['epf_co_rate']
+
+@formula('ETF_Company_Amt', ['Basic salary'], config=['etf_co_rate'], rounding='half_up')
+def _etf_company(v, cfg):
+    return v['Basic salary'] * cfg['etf_co_rate']
+
+def _formula_order():
+    """Topological order of FORMULAS; raises ValueError on cycles or unknown inputs."""
+    order, state = [], {}
+    def visit(name):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise ValueError(f"Formula cycle through '{name}'")
+        state[name] = 'visiting'
+        for dep in FORMULAS[name]['inputs']:
+            if dep in FORMULAS:
+                visit(dep)
+            elif dep not in NUMERIC_COLS:
+                raise ValueError(f"Formula '{name}' reads unknown column '{dep}'")
+        state[name] = 'done'
+        order.append(name)
+    for name in FORMULAS:
+        visit(name)
+    return order
+
+FORMULA_ORDER = _formula_order()
+
+def resolve_config(config):
+    """Config with defaults applied, as the formulas see it."""
+    working_days = config.get('working_days', 30)
+    return {
+        'working_days': working_days if working_days else 30,
+        'epf_emp_rate': config.get('epf_emp_rate', 0.08),
+        'epf_co_rate': config.get('epf_co_rate', 0.12),
+        'etf_co_rate': config.get('etf_co_rate', 0.03),
+        'stamps_fee': config.get('stamps_fee', 25.0),
+        'money_mode': config.get('money_mode', 'float'),
+    }
+
+def formulas_affected_by(config_keys):
+    """Formulas that read any of config_keys, directly or through another formula."""
+    if 'money_mode' in config_keys:
+        return set(FORMULA_ORDER)
+    affected = set()
+    for name in FORMULA_ORDER:
+        spec = FORMULAS[name]
+        if set(spec['config']) & set(config_keys) or any(dep in affected for dep in spec['inputs']):
+            affected.add(name)
+    return affected
+
+def _inputs(values, cfg):
+    """The formula env for cfg's money mode: float64 rupees, or int64 cents for the amounts."""
+    if cfg['money_mode'] == 'float':
+        return dict(values)
+    if cfg['money_mode'] != 'cents':
+        raise ValueError(f"Unknown money mode '{cfg['money_mode']}'")
+    return {col: _to_cents(arr * 100) if col in MONEY_COLS else arr for col, arr in values.items()}
+
+def _evaluate(env, cfg, names):
+    # env holds the input arrays plus any formula values already computed
+    cents = cfg['money_mode'] == 'cents'
+    if cents:
+        cfg = dict(cfg, **{key: int(_to_cents(cfg[key] * 100)) for key in MONEY_CONFIG})
+    for name in FORMULA_ORDER:
+        if name in names:
+            result = FORMULAS[name]['fn'](env, cfg)
+            if cents and result.dtype.kind == 'f':
+                rounding = FORMULAS[name]['rounding']
+                if rounding is None:
+                    raise ValueError(f"Formula '{name}' produced fractional cents without a rounding rule")
+                result = _to_cents(result, rounding)
+            env[name] = result
+    return env
+
+def _outputs(env, cfg, names):
+    """The output formulas among names as float64 rupees."""
+    outputs = {name: env[name] for name in FORMULA_ORDER if name in names and FORMULAS[name]['output']}
+    if cfg['money_mode'] == 'cents':
+        outputs = {name: arr / 100 for name, arr in outputs.items()}
+    return outputs
+
+def evaluate_formulas(values, config):
+    """Evaluate every formula over the float64 input arrays in `values`.
+
+    Returns {column: array} for the output formulas only, in rupees whatever the money mode.
+    """
+    cfg = resolve_config(config)
+    env = _evaluate(_inputs(values, cfg), cfg, set(FORMULA_ORDER))
+    return _outputs(env, cfg, set(FORMULA_ORDER))
+
+# --- PIPELINE STAGES ---
+# process_payroll_data runs these back to back; PayrollPipeline keeps each
+# stage's output so that only the stages whose inputs changed are redone.
+def _ingest(df_excel):
+    """Standardize Employee ID columns for merging and drop personal columns owned by the DB."""
+    if 'Employee ID' in df_excel.columns:
+        df_excel = df_excel.rename(columns={'Employee ID': 'emp_id'})
+    else:
+        df_excel = df_excel.copy()
+    
+    df_excel['emp_id'] = df_excel['emp_id'].astype(str).str.strip()
+    
+    # REMOVE DUPLICATE COLUMNS FROM EXCEL
+    conflicting_cols = ['Name', 'name', 'Designation', 'designation', 'Department', 'department', 
+                        'NIC', 'nic', 'Bank', 'bank_name', 'Account', 'account_no', 'Joined Date', 'joined_date']
+    return df_excel.drop(columns=[c for c in conflicting_cols if c in df_excel.columns], errors='ignore')
+
+def _merge_master(df_excel, df_db):
+    """MERGE Excel (Financials) with DB (Personal Details)."""
+    if not df_db.empty:
+        df_db = df_db.copy()
+        df_db['emp_id'] = df_db['emp_id'].astype(str).str.strip()
+        df_merged = pd.merge(df_excel, df_db, on='emp_id', how='left')
+    else:
+        df_merged = df_excel.copy()
+        for col in ['name', 'designation', 'department', 'nic', 'bank_name', 'account_no']:
+            df_merged[col] = "N/A"
+
+    # Fill Missing Personal Data
+    fill_defaults = {
+        'name': 'Unknown Employee', 'designation': '-', 'department': '-',
+        'nic': '-', 'bank_name': '-', 'account_no': '-'
+    }
+    df_merged.fillna(fill_defaults, inplace=True)
+    return df_merged.rename(columns={'name': 'Name', 'emp_id': 'Employee ID'})
+
+def _clean_numeric(df_merged):
+    """Zero-fill NUMERIC_COLS; returns the frame and its float64 input arrays."""
+    for col in NUMERIC_COLS:
+        if col not in df_merged.columns:
+            df_merged[col] = 0.0
+    
+    df_merged[NUMERIC_COLS] = df_merged[NUMERIC_COLS].fillna(0.0)
+    return df_merged, {col: df_merged[col].to_numpy(dtype='float64') for col in NUMERIC_COLS}
+
+def _finalize(df_merged, outputs):
+    df_merged = df_merged.assign(**outputs)
+    return df_merged.loc[:, ~df_merged.columns.duplicated()]
+
+def _calculate(df_excel, df_db, config):
+    """Every stage for one frame, each timed as a processor.* span."""
+    rows = len(df_excel)
+    with span('processor.ingest', rows):
+        df = _ingest(df_excel)
+    with span('processor.merge', rows):
+        df = _merge_master(df, df_db)
+    with span('processor.clean_numeric', rows):
+        df, values = _clean_numeric(df)
+    with span('processor.formulas', rows):
+        outputs = evaluate_formulas(values, config)
+    with span('processor.finalize', rows):
+        return _finalize(df, outputs)
+
+@timed('processor.process_payroll_data', rows=len)
 def process_payroll_data(df_excel, config):
     try:
         logging.info("--- STARTED PAYROLL CALCULATION PROCESS ---")
@@ -14,85 +268,94 @@ def process_payroll_data(df_excel, config):
         df_db = get_all_employees()
         logging.info(f"Fetched {len(df_db)} employee records from Master Database.")
         
-        # 2. Standardize Employee ID columns for merging
-        if 'Employee ID' in df_excel.columns:
-            df_excel = df_excel.rename(columns={'Employee ID': 'emp_id'})
-        
-        df_excel['emp_id'] = df_excel['emp_id'].astype(str).str.strip()
-        
-        # STEP 1.5: REMOVE DUPLICATE COLUMNS FROM EXCEL ---
-        conflicting_cols = ['Name', 'name', 'Designation', 'designation', 'Department', 'department', 
-                            'NIC', 'nic', 'Bank', 'bank_name', 'Account', 'account_no', 'Joined Date', 'joined_date']
-        df_excel = df_excel.drop(columns=[c for c in conflicting_cols if c in df_excel.columns], errors='ignore')
-
-        # 3. MERGE Excel (Financials) with DB (Personal Details)
-        if not df_db.empty:
-            df_db['emp_id'] = df_db['emp_id'].astype(str).str.strip()
-            df_merged = pd.merge(df_excel, df_db, on='emp_id', how='left')
-        else:
-            df_merged = df_excel
-            for col in ['name', 'designation', 'department', 'nic', 'bank_name', 'account_no']:
-                df_merged[col] = "N/A"
-
-        # Fill Missing Personal Data
-        fill_defaults = {
-            'name': 'Unknown Employee', 'designation': '-', 'department': '-',
-            'nic': '-', 'bank_name': '-', 'account_no': '-'
-        }
-        df_merged.fillna(fill_defaults, inplace=True)
-        df_merged = df_merged.rename(columns={'name': 'Name', 'emp_id': 'Employee ID'})
-
-        # 4. NUMERIC CLEANUP
-        numeric_cols = [
-            'Basic salary', 'Reimburse allowances', 'Travelling allowances', 
-            'Nopay days', 'Salary adjustment', 'Tax rate', 'APIT', 
-            'Salary advances', 'Loan installment', 'Loan interest', 'Others', 'Stamps fee'
-        ]
-        
-        for col in numeric_cols:
-            if col not in df_merged.columns:
-                df_merged[col] = 0.0
-        
-        df_merged[numeric_cols] = df_merged[numeric_cols].fillna(0.0)
+        # 2. Standardize IDs, 3. merge with the master, 4. numeric cleanup,
+        # --- CALCULATION LOGIC --- then 5. FINAL CLEANUP
+        df_merged = _calculate(df_excel, df_db, config)
 
-        # --- CALCULATION LOGIC ---_
-        df_merged['Gross Salary'] = df_merged['Basic salary'] + df_merged['Reimburse allowances'] + df_merged['Travelling allowances']
-        
-        working_days = config.get('working_days', 30)
-        if working_days == 0: working_days = 30
-        
-        df_merged['Nopay Amount'] = (df_merged['Basic salary'] / working_days) * df_merged['Nopay days']
-        df_merged['Liable Salary'] = df_merged['Gross Salary'] - df_merged['Nopay Amount'] - df_merged['Salary adjustment']
-        df_merged['Tax_Calculated'] = df_merged['Liable Salary'] * df_merged['Tax rate']
-        df_merged['Total_Tax'] = df_merged['Tax_Calculated'] + df_merged['APIT']
+        logging.info(f"SUCCESS: Calculated payroll for {len(df_merged)} employees.")
+        logging.info(f"Total Net Payout: {df_merged['Net Salary'].sum()}")
+        return df_merged
 
-        epf_emp_rate = config.get('epf_emp_rate', 0.08)
-        df_merged['EPF_Employee_Amt'] = df_merged['Basic salary'] * epf_emp_rate
+    except Exception as e:
+        logging.error(f"CRITICAL ERROR in the Payroll Calculation: {str(e)}")
+        raise e
 
-        global_stamp = config.get('stamps_fee', 25.0)
-        if 'Stamps fee' in df_merged.columns:
-            df_merged['Stamps_Final'] = df_merged['Stamps fee'].apply(lambda x: x if x > 0 else global_stamp)
-        else:
-            df_merged['Stamps_Final'] = global_stamp
+class PayrollPipeline:
+    """process_payroll_data split into cached stages: ingest -> merge -> numeric cleanup -> derived columns.
 
-        df_merged['Total Deduction'] = (
-            df_merged['Nopay Amount'] + df_merged['Salary adjustment'] + df_merged['Total_Tax'] + 
-            df_merged['EPF_Employee_Amt'] + df_merged['Salary advances'] + df_merged['Loan installment'] + 
-            df_merged['Loan interest'] + df_merged['Others'] + df_merged['Stamps_Final']
-        )
+    Keep one instance per session. run() redoes ingest/merge/cleanup only for a new
+    upload (source_key), after an employee master write, or when refresh_master is
+    set; otherwise a config change recomputes just the formulas that depend on the
+    changed keys.
+    """
 
-        df_merged['Net Salary'] = df_merged['Gross Salary'] - df_merged['Total Deduction']
+    def __init__(self):
+        self._source_key = None
+        self._values = None       # float64 input arrays
+        self._env = None          # input arrays in the money mode's units + every formula value
+        self._cfg = None
+        self._master_version = None
+        self._result = None
+        self.last_recomputed = []
 
-        df_merged['EPF_Company_Amt'] = df_merged['Basic salary'] * config.get('epf_co_rate', 0.12)
-        df_merged['ETF_Company_Amt'] = df_merged['Basic salary'] * config.get('etf_co_rate', 0.03)
+    @timed('processor.pipeline_run', rows=len)
+    def run(self, df_excel, config, source_key=None, refresh_master=False):
+        try:
+            cfg = resolve_config(config)
+            source_key = source_key if source_key is not None else id(df_excel)
+            master_version = get_employee_master_version()
+            if (self._result is None or refresh_master or source_key != self._source_key 
+                    or master_version != self._master_version):
+                df_db = get_all_employees()
+                self._master_version = master_version
+                rows = len(df_excel)
+                with span('processor.ingest', rows):
+                    df = _ingest(df_excel)
+                with span('processor.merge', rows):
+                    df = _merge_master(df, df_db)
+                with span('processor.clean_numeric', rows):
+                    self._result, self._values = _clean_numeric(df)
+                self._env = _inputs(self._values, cfg)
+                self._source_key = source_key
+                stale = set(FORMULA_ORDER)
+                logging.info(f"PIPELINE: Merged {len(self._result)} rows with {len(df_db)} master records.")
+            else:
+                stale = formulas_affected_by({k for k in cfg if cfg[k] != self._cfg[k]})
+                if cfg['money_mode'] != self._cfg['money_mode']:
+                    self._env = _inputs(self._values, cfg)
 
-        # 5. FINAL CLEANUP
-        df_merged = df_merged.loc[:, ~df_merged.columns.duplicated()]
+            with span('processor.formulas', len(self._result)):
+                _evaluate(self._env, cfg, stale)
+            self._cfg = cfg
+            self.last_recomputed = [name for name in FORMULA_ORDER if name in stale]
+            with span('processor.finalize', len(self._result)):
+                self._result = _finalize(self._result, _outputs(self._env, cfg, stale))
+            logging.info(f"PIPELINE: Recomputed {len(self.last_recomputed)} of {len(FORMULA_ORDER)} formulas "
+                         f"for {len(self._result)} employees.")
+            return self._result
 
-        logging.info(f"SUCCESS: Calculated payroll for {len(df_merged)} employees.")
-        logging.info(f"Total Net Payout: {df_merged['Net Salary'].sum()}")
-        return df_merged
+        except Exception as e:
+            logging.error(f"CRITICAL ERROR in the Payroll Calculation: {str(e)}")
+            raise e
 
-    except Exception as e:
-        logging.error(f"CRITICAL ERROR in the Payroll Calculation: {str(e)}")
-        raise e
\ No newline at end of file
+# --- RESULT MEMOIZATION ---
+# Shared by all sessions: the same (workbook, settings, employee master version)
+# is calculated once. Parsed uploads are memoized in ingest.py.
+_result_cache = LRUCache(max_entries=16)
+
+def payroll_cache_key(upload_digest, config):
+    return (upload_digest, tuple(sorted(resolve_config(config).items())), get_employee_master_version())
+
+def get_payroll_result(pipeline, df_excel, config, upload_digest):
+    """Memoized pipeline.run(); the returned frame is shared and must not be modified."""
+    key = payroll_cache_key(upload_digest, config)
+    result = _result_cache.get(key)
+    if result is None:
+        result = pipeline.run(df_excel, config, source_key=upload_digest)
+        _result_cache.put(key, result)
+    else:
+        logging.info(f"CACHE: Served payroll result for upload {upload_digest[:12]} from cache.")
+    return result
+
+def get_payroll_cache_stats():
+    return _result_cache.stats()
@@ -1,4 +1,5 @@
 import streamlit.web.cli as stcli
+import multiprocessing
 import os
 import sys
 import webbrowser
@@ -15,6 +16,9 @@ def open_browser():
     webbrowser.open_new("http://localhost:8501")
 
 if __name__ == "__main__":
+    # Needed in the frozen .exe so payslip worker processes don't relaunch the app
+    multiprocessing.freeze_support()
+
     # Start the browser thread
     threading.Thread(target=open_browser).start()
 
@@ -0,0 +1,45 @@
+"""The history lookups must be index searches, never a scan of payroll_history.
+
+Run from the repository root: python -m pytest -q
+"""
+import pytest
+import database
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'DB_NAME', str(tmp_path / "history.db"))
+    database.init_db()
+    with database.get_connection() as c:
+        yield c
+    database.close_connections()
+
+def _plan(conn, query):
+    sql, params = query
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def _assert_searches(plan, index):
+    assert any(step.startswith("SEARCH payroll_history USING") and index in step for step in plan), plan
+    assert not any(step.startswith("SCAN") for step in plan), plan
+
+@pytest.mark.parametrize('all_runs', [False, True])
+def test_fetch_history_uses_period_run_index(conn, all_runs):
+    _assert_searches(_plan(conn, database._history_query('March', 2026, all_runs)), 'idx_history_period_run')
+
+@pytest.mark.parametrize('all_runs', [False, True])
+def test_fetch_history_range_uses_period_run_index(conn, all_runs):
+    query = database._history_range_query(202504, 202603, all_runs=all_runs)
+    _assert_searches(_plan(conn, query), 'idx_history_period_run')
+
+@pytest.mark.parametrize('all_runs', [False, True])
+def test_fetch_history_range_for_employee_uses_emp_period_run_index(conn, all_runs):
+    query = database._history_range_query(202504, 202603, emp_id='E001', all_runs=all_runs)
+    _assert_searches(_plan(conn, query), 'idx_history_emp_period_run')
+
+def test_latest_run_subquery_is_covered_by_index(conn):
+    plan = _plan(conn, database._history_query('March', 2026))
+    assert "SEARCH latest USING COVERING INDEX idx_history_period_run (period=?)" in plan, plan
+
+def test_schema_has_exactly_the_history_indexes(conn):
+    indexes = {name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='payroll_history' AND sql IS NOT NULL")}
+    assert indexes == {'idx_history_emp_period_run', 'idx_history_period_run'}